@@ -0,0 +1,108 @@
+"""
+Micro-benchmark for turning a messages response into a rendered screen.
+
+Times what one poll costs against a server that resends the whole
+history: decoding the body (json, and orjson/ujson when installed),
+merging it into a view that already holds its scrollback (records are
+only built for what the view keeps), and rendering the public chat view,
+for 1k/10k/100k messages. Also reports the memory a view's records keep
+against plain dicts.
+
+Usage:
+    python3 bench_decode.py [--sizes 1000 10000 100000] [--repeat 3]
+"""
+
+import argparse
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+import main
+
+
+def make_messages(count):
+    now = time.time() - count
+    return [
+        {'sender': f'user{i % 50}', 'message': f'message number {i} ' + 'x' * (i % 80), 'timestamp': now + i}
+        for i in range(count)
+    ]
+
+
+def best_of(repeat, func, *args):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def kept_memory(func, *args):
+    """Bytes allocated by func that its result still holds on to"""
+    tracemalloc.start()
+    result = func(*args)
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return kept
+
+
+def row(label, elapsed):
+    print(f"  {label:<24} {elapsed * 1000:8.1f} ms")
+
+
+def render(messages):
+    main.screen.invalidate()
+    out = main.screen.out
+    main.screen.out = io.StringIO()
+    try:
+        main.display_public_chat('bench', messages)
+    finally:
+        main.screen.out = out
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmark message decoding and rendering")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    decoders = [("json", json.loads)]
+    if main.orjson is not None:
+        decoders.append(("orjson", main.orjson.loads))
+    if main.ujson is not None:
+        decoders.append(("ujson", main.ujson.loads))
+
+    for count in args.sizes:
+        history = make_messages(count)
+        data = json.dumps(history).encode('utf-8')
+        print(f"\n{count} messages, {len(data) / 1024 / 1024:.1f} MB body")
+        for name, decode in decoders:
+            elapsed, _ = best_of(args.repeat, decode, data)
+            row(f"decode {name}", elapsed)
+
+        # The view holds the scrollback before the newest message arrived
+        held, _ = main.merge_messages([], history[:-1], None, main.SCROLLBACK_LINES)
+        since = main.latest_timestamp(held)
+        fetched = main.decode_json(data)
+        elapsed, _ = best_of(args.repeat, main.merge_messages, held, fetched, since, main.SCROLLBACK_LINES)
+        row("merge, 1 new", elapsed)
+        elapsed, _ = best_of(args.repeat, main.merge_messages, held, fetched[:-1], since, main.SCROLLBACK_LINES)
+        row("merge, nothing new", elapsed)
+
+        messages, _ = main.merge_messages(held, fetched, since, main.SCROLLBACK_LINES)
+        elapsed, _ = best_of(args.repeat, render, messages)
+        row(f"render {len(messages)} messages", elapsed)
+
+        scrollback = history[-main.SCROLLBACK_LINES:]
+        dicts = kept_memory(lambda: json.loads(json.dumps(scrollback)))
+        records = kept_memory(lambda: main.to_messages(json.loads(json.dumps(scrollback))))
+        print(f"  scrollback kept as dicts {dicts / 1024:.0f} KB, as records {records / 1024:.0f} KB")
+
+
+if __name__ == '__main__':
+    sys.exit(main_bench())
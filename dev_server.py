@@ -0,0 +1,518 @@
+"""
+Local stand-in for the chat server, for testing the client offline.
+
+Implements the same ?action= API as the real server, in memory, plus the
+optional extensions the client knows how to use (since cursors, paging
+with before/limit, long-poll, streamed messages, chunked uploads, ranged
+downloads, content-addressed file storage, gzip in both directions and
+batched requests, de-duplicated message retries, ETags with 304 Not
+Modified and Cache-Control max-age on reads).
+
+Usage:
+    python3 dev_server.py [--port 8765]
+    CHAT_SERVER_URL=http://127.0.0.1:8765 python3 main.py
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import random
+import string
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+STREAM_HEARTBEAT = 15
+STREAM_MAX_DURATION = 300
+MAX_WAIT = 60
+GZIP_MIN_SIZE = 1024
+# Reads that change rarely may be reused by clients for this long;
+# everything else has to be revalidated (ETag) every time
+CACHEABLE_ACTIONS = ('room_info', 'deleted_rooms', 'user_rooms', 'list_files')
+CACHE_MAX_AGE = 5
+
+users = {}
+messages = []
+private_messages = []
+rooms = {}
+room_messages = {}
+deleted_rooms = {}
+files = {}
+blobs = {}
+uploads = {}
+sent_ids = {}
+
+state_lock = threading.Lock()
+new_message = threading.Condition(state_lock)
+
+def random_code(length=6):
+    return ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(length))
+
+def since_filter(items, since):
+    if since is None:
+        return list(items)
+    return [item for item in items if item.get('timestamp', 0) >= since]
+
+def page_filter(items, before, limit):
+    """Older-than-`before` messages, only the newest `limit` of them"""
+    if before is not None:
+        items = [item for item in items if item.get('timestamp', 0) < before]
+    return items[-limit:] if limit else items
+
+def view_messages(params):
+    """Messages for the view described by the request params, or None"""
+    action = params.get('action')
+    if action in ('messages', 'stream') and not params.get('room_id') and not params.get('user'):
+        return messages
+    if action in ('room_messages', 'stream') and params.get('room_id'):
+        return room_messages.get(params['room_id'], [])
+    if action in ('private_messages', 'stream') and params.get('user'):
+        user = params['user']
+        return [pm for pm in private_messages if user in (pm['sender'], pm['receiver'])]
+    return None
+
+def store_blob(data):
+    """Keep one copy of each distinct content, returns its SHA-256"""
+    sha256 = hashlib.sha256(data).hexdigest()
+    if sha256 not in blobs:
+        blobs[sha256] = {'data': bytes(data), 'refs': set()}
+    return sha256
+
+def store_file(meta, sha256, now):
+    """Register a shared file pointing at an existing blob, returns its code"""
+    code = random_code()
+    hours = int(str(meta.get('expire', '24h')).rstrip('h') or 24)
+    blob = blobs[sha256]
+    blob['refs'].add(code)
+    files[code] = {
+        'original_filename': meta.get('filename'),
+        'size': len(blob['data']),
+        'sender': meta.get('sender'),
+        'room_id': meta.get('room_id'),
+        'private_to': meta.get('private_to'),
+        'uploaded_at': now,
+        'expires': now + hours * 3600,
+        'downloads': 0,
+        'sha256': sha256,
+        'data': blob['data']
+    }
+    return code
+
+def release_file(code):
+    """Forget a shared file, dropping its blob once nothing refers to it"""
+    entry = files.pop(code)
+    blob = blobs[entry['sha256']]
+    blob['refs'].discard(code)
+    if not blob['refs']:
+        del blobs[entry['sha256']]
+
+def parse_recipients(text):
+    """Split '@john,@maria @jane hello' into (['john', 'maria', 'jane'], 'hello')"""
+    recipients = []
+    rest = text
+    while rest.startswith('@'):
+        token, _, rest = rest.partition(' ')
+        recipients.extend(name.lstrip('@') for name in token.split(',') if name.strip('@'))
+        rest = rest.lstrip()
+    return recipients, rest
+
+def post_message(payload, now):
+    """Store a public, room or private (@user) message; caller holds the lock"""
+    sender = payload.get('sender')
+    text = payload.get('message', '')
+    room_id = payload.get('room_id')
+    # Handed back so the client can replace its local echo
+    extra = {'client_id': payload['client_id']} if payload.get('client_id') else {}
+
+    if text.startswith('@'):
+        recipients, text = parse_recipients(text)
+        for receiver in recipients:
+            private_messages.append({'sender': sender, 'receiver': receiver, 'message': text, 'timestamp': now, **extra})
+        new_message.notify_all()
+        return {'status': 'success', 'type': 'private'}
+
+    if room_id:
+        if room_id in deleted_rooms:
+            return {'status': 'error', 'message': 'Room has been deleted'}
+        if room_id not in rooms:
+            return {'status': 'error', 'message': 'Room not found'}
+        room_messages.setdefault(room_id, []).append({'sender': sender, 'message': text, 'timestamp': now, **extra})
+        new_message.notify_all()
+        return {'status': 'success', 'type': 'room'}
+
+    messages.append({'sender': sender, 'message': text, 'timestamp': now, **extra})
+    new_message.notify_all()
+    return {'status': 'success', 'type': 'public'}
+
+# ============================================
+# GET ACTIONS
+# ============================================
+
+def handle_get(params):
+    action = params.get('action')
+    since = float(params['since']) if params.get('since') else None
+    wait = min(float(params.get('wait') or 0), MAX_WAIT)
+    before = float(params['before']) if params.get('before') else None
+    limit = int(params['limit']) if params.get('limit') else None
+
+    if action in ('messages', 'room_messages', 'private_messages'):
+        if action == 'room_messages' and params.get('room_id') in deleted_rooms:
+            return {'status': 'error', 'message': 'Room has been deleted'}
+        deadline = time.time() + wait
+        with new_message:
+            while True:
+                result = since_filter(view_messages(params) or [], since)
+                remaining = deadline - time.time()
+                # Long-poll: hold until something strictly newer than the cursor exists
+                if since is None or remaining <= 0 or any(item.get('timestamp', 0) > since for item in result):
+                    return page_filter(result, before, limit)
+                new_message.wait(remaining)
+
+    with state_lock:
+        if action == 'deleted_rooms':
+            return deleted_rooms
+
+        if action == 'room_info':
+            room = rooms.get(params.get('room_id'))
+            if not room or params.get('room_id') in deleted_rooms:
+                return {'status': 'error', 'message': 'Room not found'}
+            return {'status': 'success', 'room': room}
+
+        if action == 'user_rooms':
+            username = params.get('username')
+            return [{'id': room_id, 'name': room['name'], 'joined_at': room['joined'].get(username, 0)}
+                    for room_id, room in rooms.items()
+                    if username in room['users'] and room_id not in deleted_rooms]
+
+        if action == 'list_files':
+            username = params.get('username')
+            visible = {}
+            for code, entry in files.items():
+                if entry['private_to'] and username not in (entry['private_to'], entry['sender']):
+                    continue
+                visible[code] = {key: value for key, value in entry.items() if key not in ('data', 'sha256')}
+            return visible
+
+        if action == 'upload_status':
+            upload = uploads.get(params.get('upload_id'))
+            if not upload:
+                return {'status': 'error', 'message': 'Unknown upload'}
+            return {'status': 'success', 'offsets': sorted(upload['parts']), 'compression': upload['compression']}
+
+        if action == 'download_file':
+            entry = files.get(params.get('file_code'))
+            if not entry:
+                return {'status': 'error', 'message': 'File not found'}
+            entry['downloads'] += 1
+            return {
+                'status': 'success',
+                'filename': entry['original_filename'],
+                'filesize': entry['size'],
+                'filedata': base64.b64encode(entry['data']).decode('ascii')
+            }
+
+    return {'status': 'error', 'message': f'Unknown action: {action}'}
+
+def handle_batch(payload):
+    """{'action': 'batch', 'requests': [params, ...]}: GET actions and
+    send_message, answered in order"""
+    calls = payload.get('requests')
+    if not isinstance(calls, list):
+        return {'status': 'error', 'message': 'Batch needs a requests list'}
+    responses = []
+    for params in calls:
+        if not isinstance(params, dict) or params.get('action') in ('batch', 'stream', 'download_raw'):
+            responses.append({'status': 'error', 'message': 'Not allowed in a batch'})
+            continue
+        if params.get('action') == 'send_message':
+            responses.append(handle_post(params))
+        else:
+            responses.append(handle_get({key: str(value) for key, value in params.items()}))
+    return {'status': 'success', 'responses': responses}
+
+# ============================================
+# POST ACTIONS
+# ============================================
+
+def handle_post(payload):
+    action = payload.get('action')
+    now = time.time()
+
+    with new_message:
+        if action == 'signup':
+            if payload.get('username') in users:
+                return {'status': 'error', 'message': 'Username already taken'}
+            users[payload.get('username')] = payload.get('password')
+            return {'status': 'success'}
+
+        if action == 'login':
+            if users.get(payload.get('username')) != payload.get('password'):
+                return {'status': 'error', 'message': 'Invalid username or password'}
+            return {'status': 'success'}
+
+        if action == 'send_message':
+            # A retried send (same client_id) gets the first answer again
+            client_id = payload.get('client_id')
+            if client_id in sent_ids:
+                return sent_ids[client_id]
+            result = post_message(payload, now)
+            if client_id and result['status'] == 'success':
+                sent_ids[client_id] = result
+            return result
+
+        if action == 'create_room':
+            room_id = random_code()
+            rooms[room_id] = {'name': payload.get('room_name'), 'creator': payload.get('creator'),
+                              'created_at': now, 'users': [], 'joined': {}}
+            return {'status': 'success', 'room_id': room_id, 'message': 'Room created'}
+
+        if action == 'join_room':
+            room_id = payload.get('room_id')
+            if room_id in deleted_rooms:
+                return {'status': 'error', 'message': 'Room has been deleted'}
+            room = rooms.get(room_id)
+            if not room:
+                return {'status': 'error', 'message': 'Room not found'}
+            username = payload.get('username')
+            if username not in room['users']:
+                room['users'].append(username)
+                room['joined'][username] = now
+            return {'status': 'success', 'room': room}
+
+        if action == 'leave_room':
+            room = rooms.get(payload.get('room_id'))
+            if not room or payload.get('username') not in room['users']:
+                return {'status': 'error', 'message': 'Not in room'}
+            room['users'].remove(payload.get('username'))
+            return {'status': 'success', 'message': 'Left room'}
+
+        if action == 'delete_room':
+            deleted_rooms[payload.get('room_id')] = {'deleted_at': now}
+            return {'status': 'success'}
+
+        if action == 'upload_file':
+            sha256 = store_blob(base64.b64decode(payload.get('filedata', '')))
+            return {'status': 'success', 'file_code': store_file(payload, sha256, now)}
+
+        if action == 'link_file':
+            # Metadata-only share of content we already hold
+            blob = blobs.get(payload.get('sha256'))
+            if not blob or len(blob['data']) != int(payload.get('filesize', -1)):
+                return {'status': 'error', 'message': 'Unknown content'}
+            code = store_file(payload, payload['sha256'], now)
+            return {'status': 'success', 'file_code': code, 'deduplicated': True}
+
+        if action == 'upload_init':
+            upload_id = random_code(16)
+            compression = 'gzip' if payload.get('compression') == 'gzip' else None
+            uploads[upload_id] = {'meta': payload, 'parts': {}, 'compression': compression}
+            return {'status': 'success', 'upload_id': upload_id, 'compression': compression}
+
+        if action == 'upload_complete':
+            upload = uploads.get(payload.get('upload_id'))
+            if not upload:
+                return {'status': 'error', 'message': 'Unknown upload'}
+            data = b''.join(upload['parts'][offset] for offset in sorted(upload['parts']))
+            if len(data) != int(upload['meta'].get('filesize', 0)):
+                return {'status': 'error', 'message': 'Upload incomplete'}
+            if upload['meta'].get('sha256') and hashlib.sha256(data).hexdigest() != upload['meta']['sha256']:
+                return {'status': 'error', 'message': 'Checksum mismatch'}
+            del uploads[payload.get('upload_id')]
+            return {'status': 'success', 'file_code': store_file(upload['meta'], store_blob(data), now)}
+
+        if action == 'delete_file':
+            entry = files.get(payload.get('file_code'))
+            if not entry or entry['sender'] != payload.get('username'):
+                return {'status': 'error', 'message': 'File not found'}
+            release_file(payload.get('file_code'))
+            return {'status': 'success'}
+
+    return {'status': 'error', 'message': f'Unknown action: {action}'}
+
+def handle_upload_chunk(params, body):
+    """Raw chunk body, action/upload_id/offset/sha256 in the query string
+
+    Chunks may arrive in any order (parallel uploads); a re-sent chunk
+    replaces the earlier copy.
+    """
+    if params.get('sha256') and hashlib.sha256(body).hexdigest() != params['sha256']:
+        return {'status': 'error', 'message': 'Checksum mismatch'}
+    with state_lock:
+        upload = uploads.get(params.get('upload_id'))
+        if not upload:
+            return {'status': 'error', 'message': 'Unknown upload'}
+        upload['parts'][int(params.get('offset', 0))] = body
+        return {'status': 'success'}
+
+# ============================================
+# HTTP HANDLER
+# ============================================
+
+class ChatRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def accepts_gzip(self):
+        return 'gzip' in self.headers.get('Accept-Encoding', '')
+
+    def send_json(self, data, status=200, etag=False, max_age=None):
+        body = json.dumps(data).encode('utf-8')
+        cache_control = f'max-age={max_age}' if max_age else 'no-cache'
+        if etag:
+            # Validator of the JSON itself, so it's the same gzipped or not
+            tag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+            if self.headers.get('If-None-Match') == tag:
+                self.send_response(304)
+                self.send_header('ETag', tag)
+                self.send_header('Cache-Control', cache_control)
+                self.end_headers()
+                return
+        compressed = self.accepts_gzip() and len(body) >= GZIP_MIN_SIZE
+        if compressed:
+            body = gzip.compress(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        if etag:
+            self.send_header('ETag', tag)
+            self.send_header('Cache-Control', cache_control)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def stream_messages(self, params):
+        """Chunked NDJSON: one message per line, blank lines as heartbeats"""
+        since = float(params['since']) if params.get('since') else None
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        started = time.time()
+        try:
+            while time.time() - started < STREAM_MAX_DURATION:
+                with new_message:
+                    pending = since_filter(view_messages(params) or [], since)
+                    if not pending:
+                        new_message.wait(STREAM_HEARTBEAT)
+                        pending = since_filter(view_messages(params) or [], since)
+
+                if pending:
+                    # Strictly newer from here on, the client de-duplicates the boundary
+                    since = max(item.get('timestamp', 0) for item in pending) + 1e-6
+                    self.write_chunk(b''.join(json.dumps(item).encode('utf-8') + b'\n' for item in pending))
+                else:
+                    self.write_chunk(b'\n')
+            self.write_chunk(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def send_file(self, params):
+        """Raw file bytes, honouring 'Range: bytes=a-b' / 'bytes=a-' requests"""
+        with state_lock:
+            entry = files.get(params.get('file_code'))
+        if not entry:
+            self.send_json({'status': 'error', 'message': 'File not found'})
+            return
+
+        data = entry['data']
+        start, end = 0, len(data) - 1
+        range_header = self.headers.get('Range', '')
+        partial = range_header.startswith('bytes=') and len(data) > 0
+        if partial:
+            first, _, last = range_header[6:].partition('-')
+            start = min(int(first), len(data) - 1)
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+        body = data[start:end + 1]
+        content_sha256 = hashlib.sha256(body).hexdigest()
+        # Ranges always refer to the original bytes, each part is gzipped on its own
+        compressed = self.accepts_gzip() and len(body) >= GZIP_MIN_SIZE
+        if compressed:
+            body = gzip.compress(body)
+        if end == len(data) - 1:
+            # Count each download once, when its last byte is served
+            with state_lock:
+                entry['downloads'] += 1
+
+        self.send_response(206 if partial else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Disposition', f'attachment; filename="{entry["original_filename"]}"')
+        self.send_header('X-File-Size', str(len(data)))
+        self.send_header('X-File-SHA256', entry['sha256'])
+        self.send_header('X-Content-SHA256', content_sha256)
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        if partial:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        if params.get('action') == 'stream':
+            self.stream_messages(params)
+            return
+        if params.get('action') == 'download_raw':
+            self.send_file(params)
+            return
+        max_age = CACHE_MAX_AGE if params.get('action') in CACHEABLE_ACTIONS else None
+        self.send_json(handle_get(params), etag=True, max_age=max_age)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        encoding = self.headers.get('Content-Encoding', '')
+        try:
+            if encoding == 'gzip':
+                body = gzip.decompress(body)
+            elif encoding == 'deflate':
+                body = zlib.decompress(body)
+        except (OSError, zlib.error):
+            self.send_json({'status': 'error', 'message': 'Bad Content-Encoding'}, 400)
+            return
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        if params.get('action') == 'upload_chunk':
+            self.send_json(handle_upload_chunk(params, body))
+            return
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            self.send_json({'status': 'error', 'message': 'Invalid JSON'}, 400)
+            return
+        if payload.get('action') == 'batch':
+            self.send_json(handle_batch(payload))
+            return
+        self.send_json(handle_post(payload))
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in chat server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), ChatRequestHandler)
+    server.daemon_threads = True
+    print(f"Dev chat server on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,49 @@
 import requests
+import asyncio
+import json
+import queue
+import threading
 import time
 import os
 import sys
 import signal
 import select
 import base64
+import collections
+import functools
+import gzip
+import hashlib
+import itertools
 import mimetypes
 import math
+import random
+import re
+import codecs
+import shutil
+import sqlite3
+import unicodedata
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-SERVER_URL = 'https://tinyurl.com/t2db3dhv'
+try:
+    import termios
+    import tty
+except ImportError:
+    # No per-key input (Windows): the chat falls back to line input
+    termios = None
+
+# Optional faster JSON parsers, used for message lists when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+SERVER_URL = os.environ.get('CHAT_SERVER_URL', 'https://tinyurl.com/t2db3dhv')
 
 exit_flag = False
 current_mode = "public"
@@ -17,8 +52,114 @@ current_room_name = "Public Chat"
 last_display_time = 0
 refresh_interval = 3
 
+# HTTP connection pool settings
+HTTP_POOL_SIZE = 10
+HTTP_MAX_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.5
+# Read responses kept for conditional requests (ETag / Last-Modified):
+# at most HTTP_CACHE_SIZE of them and HTTP_CACHE_MAX_BYTES of bodies
+HTTP_CACHE_SIZE = 64
+HTTP_CACHE_MAX_BODY = 4 * 1024 * 1024
+HTTP_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# How new messages are received: "poll" (fixed refresh_interval),
+# "longpoll" (server holds the request) or "stream" (NDJSON/SSE push).
+# Servers without long-poll/stream support degrade to plain polling.
+RECEIVE_MODE = os.environ.get('CHAT_RECEIVE_MODE', 'longpoll')
+LONG_POLL_WAIT = 25
+STREAM_IDLE_TIMEOUT = 60
+
+# Polling adapts: POLL_MIN_INTERVAL right after activity or input, then
+# POLL_BACKOFF times longer per quiet poll up to POLL_MAX_INTERVAL.
+# Failures double the wait from refresh_interval up to POLL_ERROR_MAX_INTERVAL.
+# Every wait is spread by ±POLL_JITTER so clients don't poll in lockstep.
+POLL_MIN_INTERVAL = 1
+POLL_MAX_INTERVAL = float(os.environ.get('CHAT_POLL_MAX_INTERVAL', '30'))
+POLL_BACKOFF = 1.5
+POLL_ERROR_MAX_INTERVAL = 120
+POLL_JITTER = 0.2
+
+# Scrollback: messages kept in memory per view; /scroll (or PageUp) pulls
+# older ones from the server HISTORY_PAGE at a time
+SCROLLBACK_LINES = int(os.environ.get('CHAT_SCROLLBACK', '500'))
+HISTORY_PAGE = 100
+# Change detection hashes the newest FINGERPRINT_WINDOW messages of a view
+FINGERPRINT_WINDOW = 50
+# Screen lines whose wrapped height is remembered (until the terminal is resized)
+ROW_CACHE_SIZE = 8192
+
 # For file transfers
 active_transfers = {}
+UPLOAD_CHUNK_SIZE = 512 * 1024
+DOWNLOAD_PART_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+TRANSFER_CONCURRENCY = 4
+TRANSFER_PART_RETRIES = 3
+TRANSFER_WORKERS = 2
+_transfer_ids = itertools.count(1)
+
+# gzip level for file transfers (0 turns compression off); files whose
+# mimetype is already compressed are always sent as-is
+COMPRESSION_LEVEL = int(os.environ.get('CHAT_COMPRESSION_LEVEL', '6'))
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSED_MIMETYPES = (
+    'image/', 'video/', 'audio/', 'application/zip', 'application/gzip',
+    'application/x-gzip', 'application/x-bzip2', 'application/x-xz',
+    'application/x-7z-compressed', 'application/x-rar-compressed',
+    'application/vnd.rar', 'application/java-archive', 'application/pdf',
+    'application/vnd.openxmlformats', 'application/epub+zip'
+)
+
+# Local state (resumable uploads, caches)
+DATA_DIR = os.path.join(os.path.expanduser('~'), '.cli_chat')
+UPLOAD_STATE_FILE = os.path.join(DATA_DIR, 'uploads.json')
+OUTBOX_FILE = os.path.join(DATA_DIR, 'outbox.json')
+
+# On-disk message history per view, so views open instantly and only
+# deltas are fetched; old messages and overfull views are evicted
+MESSAGE_CACHE_FILE = os.path.join(DATA_DIR, 'messages.db')
+MESSAGE_CACHE_ENABLED = os.environ.get('CHAT_MESSAGE_CACHE', '1') != '0'
+MESSAGE_CACHE_MAX_AGE = 30 * 24 * 3600
+MESSAGE_CACHE_PER_VIEW = 2000
+
+# Recently used views stay in memory (messages + room info) so switching
+# back is instant; they are refreshed every VIEW_REFRESH_INTERVAL seconds
+# and forgotten once unused for VIEW_CACHE_TTL
+VIEW_CACHE_SIZE = 8
+VIEW_CACHE_TTL = 600
+VIEW_REFRESH_INTERVAL = 60
+
+# Views other than the one on screen (joined rooms, public, private) are
+# checked for unread messages every WATCH_INTERVAL seconds, up to
+# WATCH_MAX_VIEWS of them per (batched) request, in turns. The list of
+# joined rooms is refreshed every WATCH_ROOMS_INTERVAL.
+WATCH_INTERVAL = 15
+WATCH_MAX_VIEWS = 10
+WATCH_ROOMS_INTERVAL = 60
+# Concurrent requests when a server can't batch
+BATCH_FALLBACK_WORKERS = 4
+# Threads the chat loop runs its blocking calls (requests, prompts) on
+BLOCKING_WORKERS = 8
+
+# Outgoing messages: a send that didn't get through (timeout, connection
+# error, 5xx) is retried SEND_RETRIES times, SEND_RETRY_BACKOFF seconds
+# apart, doubling each time
+SEND_RETRIES = 3
+SEND_RETRY_BACKOFF = 1
+# After that they wait in OUTBOX_FILE (so do shares), retried every
+# OUTBOX_RETRY_INTERVAL seconds and on the next start, up to
+# SEND_BATCH_SIZE messages per request
+OUTBOX_RETRY_INTERVAL = 30
+SEND_BATCH_SIZE = 20
+# The echo of a sent message goes once its server copy is fetched (matched
+# by client_id, or by text for servers that don't return it), or once it has
+# been up SENT_ECHO_TTL seconds
+SENT_ECHO_TTL = 60
+
+# Room metadata is cached: the (global) deleted-rooms list for
+# DELETED_ROOMS_TTL seconds, each room's info for ROOM_INFO_TTL
+DELETED_ROOMS_TTL = 60
+ROOM_INFO_TTL = 30
 
 # Color codes
 GREEN = "\033[92m"
@@ -46,28 +187,343 @@ def format_file_size(size_bytes):
     s = round(size_bytes / p, 2)
     return f"{s} {size_name[i]}"
 
-def check_room_deleted(room_id):
-    try:
-        response = requests.get(SERVER_URL + '?action=deleted_rooms', timeout=3)
-        if response.status_code == 200:
-            deleted_rooms = response.json()
-            if isinstance(deleted_rooms, dict) and room_id in deleted_rooms:
-                return True, deleted_rooms[room_id].get('deleted_at', time.time())
-    except:
-        pass
+# ============================================
+# HTTP CLIENT
+# ============================================
+
+_http_session = None
+_http_lock = threading.Lock()
+_resolved_server_url = None
+_batch_supported = None
+_batch_executor = None
+
+def get_http_session():
+    """Return the shared keep-alive session used for every server call"""
+    global _http_session
+    
+    with _http_lock:
+        if _http_session is None:
+            # Connection errors are retried for any method (nothing was sent yet),
+            # read/status errors only for idempotent GETs
+            retry = Retry(
+                total=HTTP_MAX_RETRIES,
+                backoff_factor=HTTP_RETRY_BACKOFF,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET', 'HEAD']),
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            # Message lists are JSON and shrink a lot; requests decodes transparently
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+def resolve_server_url():
+    """Resolve the SERVER_URL short link once and cache the real endpoint"""
+    global _resolved_server_url
+    
+    if _resolved_server_url:
+        return _resolved_server_url
     
     try:
-        response = requests.get(SERVER_URL + '?action=room_info&room_id=' + room_id, timeout=3)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('status') == 'error':
-                return True, time.time()
+        # Only the first hop is cached: the short link itself never changes,
+        # anything the backend redirects to afterwards may be per-request
+        response = get_http_session().get(SERVER_URL, allow_redirects=False, timeout=5)
+        response.close()
+        if response.is_redirect and response.headers.get('Location'):
+            _resolved_server_url = requests.compat.urljoin(SERVER_URL, response.headers['Location'])
+        else:
+            _resolved_server_url = SERVER_URL
     except:
-        pass
+        # Try again on the next call
+        return SERVER_URL
+    
+    return _resolved_server_url
+
+class CachedResponse:
+    """A stored GET response, answering like the requests one it came from"""
+    
+    status_code = 200
+    
+    def __init__(self, entry):
+        self.headers = entry['headers']
+        self.content = entry['body']
+    
+    def json(self):
+        return json.loads(self.content)
+
+class ResponseCache:
+    """Bodies and validators of read responses, one per view, least recently used evicted first"""
+    
+    # Left out of the key: a long-poll asks for the same data, it just may
+    # wait for it; `since` is kept in the entry instead
+    VARIANT_PARAMS = ('wait', 'since')
+    
+    def __init__(self, size=HTTP_CACHE_SIZE, max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def key(params):
+        return tuple(sorted((name, str(value)) for name, value in params.items() if name not in ResponseCache.VARIANT_PARAMS))
+    
+    @staticmethod
+    def fresh(entry, params):
+        """Answerable without a request: within max-age, for the same cursor, not a long-poll"""
+        return not params.get('wait') and entry['since'] == str(params.get('since')) and time.time() < entry['expires']
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+    
+    def validators(self, entry, params):
+        """Conditional headers, only for the cursor the stored body was fetched with"""
+        headers = {}
+        if entry['since'] != str(params.get('since')):
+            return headers
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    def expires(self, response):
+        """When a response stops being fresh, None when it mustn't be stored"""
+        directives = [part.strip().lower() for part in response.headers.get('Cache-Control', '').split(',')]
+        if 'no-store' in directives:
+            return None
+        for directive in directives:
+            if directive.startswith('max-age=') and 'no-cache' not in directives:
+                try:
+                    return time.time() + int(directive[8:])
+                except ValueError:
+                    pass
+        return 0
+    
+    def store(self, key, params, response):
+        expires = self.expires(response)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if expires is None or not (etag or last_modified or expires) or len(response.content) > HTTP_CACHE_MAX_BODY:
+            self.drop(key)
+            return
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = {'body': response.content, 'headers': dict(response.headers), 'etag': etag,
+                                 'last_modified': last_modified, 'expires': expires, 'since': str(params.get('since'))}
+            self.bytes += len(response.content)
+            while len(self.entries) > self.size or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+    
+    def revalidated(self, key, entry, response):
+        """A 304 for the entry: fresh again for the new max-age"""
+        expires = self.expires(response)
+        entry['expires'] = expires or 0
+        entry['etag'] = response.headers.get('ETag', entry['etag'])
+    
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry['body'])
+    
+    def drop(self, key):
+        with self.lock:
+            self._remove(key)
+    
+    def expire_all(self):
+        """Something was changed on the server: revalidate everything"""
+        with self.lock:
+            for entry in self.entries.values():
+                entry['expires'] = 0
+
+http_cache = ResponseCache()
+
+def api_get(params, timeout=5, cache=False, **kwargs):
+    """GET with the action in the query string; cache=True goes through http_cache"""
+    if not cache:
+        return get_http_session().get(resolve_server_url(), params=params, timeout=timeout, **kwargs)
+    
+    key = http_cache.key(params)
+    entry = http_cache.get(key)
+    if entry is not None and http_cache.fresh(entry, params):
+        return CachedResponse(entry)
+    
+    headers = dict(kwargs.pop('headers', None) or {})
+    validators = http_cache.validators(entry, params) if entry is not None else {}
+    headers.update(validators)
+    response = get_http_session().get(resolve_server_url(), params=params, timeout=timeout, headers=headers, **kwargs)
+    if response.status_code == 304 and validators:
+        http_cache.revalidated(key, entry, response)
+        return CachedResponse(entry)
+    if response.status_code == 200:
+        http_cache.store(key, params, response)
+    return response
+
+def api_post(payload, timeout=5, **kwargs):
+    headers = {'Content-Type': 'application/json'}
+    if payload.get('action') != 'batch' or any(call.get('action') == 'send_message' for call in payload.get('requests', [])):
+        http_cache.expire_all()
+    return get_http_session().post(resolve_server_url(), json=payload, headers=headers, timeout=timeout, **kwargs)
+
+def api_post_bytes(params, data, timeout=30, content_type='application/octet-stream', content_encoding=None):
+    """POST a raw body (bytes, or an iterable with __len__) with the action in the query string"""
+    headers = {'Content-Type': content_type}
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    http_cache.expire_all()
+    return get_http_session().post(resolve_server_url(), params=params, data=data, headers=headers, timeout=timeout)
+
+def api_batch(calls, timeout=5):
+    """Run several GET actions in one round-trip, returns their decoded JSON in order (None: failed)
+
+    Servers without the batch action get the calls as separate requests,
+    BATCH_FALLBACK_WORKERS at a time.
+    """
+    global _batch_supported, _batch_executor
+    
+    if _batch_supported is not False and len(calls) > 1:
+        try:
+            response = api_post({'action': 'batch', 'requests': calls}, timeout=timeout)
+            data = decode_json(response.content) if response.status_code == 200 else None
+            if isinstance(data, dict) and isinstance(data.get('responses'), list) and len(data['responses']) == len(calls):
+                _batch_supported = True
+                return data['responses']
+            if response.status_code in (200, 400, 404, 405, 501):
+                # Answered, just not with a batch: it doesn't know the action
+                _batch_supported = False
+            elif _batch_supported:
+                return [None] * len(calls)
+        except:
+            # Timeout or connection error: separate requests would fare no better
+            return [None] * len(calls)
+    
+    def single(params):
+        try:
+            response = api_get(params, timeout=timeout, cache=True)
+            return decode_json(response.content) if response.status_code == 200 else None
+        except:
+            return None
+    
+    if len(calls) == 1:
+        return [single(calls[0])]
+    with _http_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=BATCH_FALLBACK_WORKERS)
+    return list(_batch_executor.map(single, calls))
+
+# ============================================
+# ROOM METADATA CACHE
+# ============================================
+
+_deleted_rooms = {}
+_deleted_rooms_fetched = 0
+_room_info_cache = {}
+_room_cache_lock = threading.Lock()
+# Rooms with a receiver polling them: poll_room refreshes their stale
+# metadata, so nothing else fetches it
+_metadata_polled = collections.Counter()
+
+def get_deleted_rooms(max_age=DELETED_ROOMS_TTL):
+    """Deleted rooms as {room_id: {'deleted_at': ...}}, refetched once older than max_age"""
+    if deleted_rooms_stale(max_age):
+        try:
+            response = api_get({'action': 'deleted_rooms'}, timeout=3, cache=True)
+            if response.status_code == 200:
+                store_deleted_rooms(response.json())
+        except:
+            pass
+    
+    return _deleted_rooms
+
+def deleted_rooms_stale(max_age=DELETED_ROOMS_TTL):
+    return time.time() - _deleted_rooms_fetched >= max_age
+
+def store_deleted_rooms(deleted_rooms):
+    """Take the server's deleted-rooms list as the whole truth, replacing earlier marks"""
+    global _deleted_rooms_fetched
+    
+    if isinstance(deleted_rooms, dict):
+        with _room_cache_lock:
+            _deleted_rooms.clear()
+            _deleted_rooms.update(deleted_rooms)
+            _deleted_rooms_fetched = time.time()
+
+def mark_room_deleted(room_id, deleted_at=None):
+    """Record a deletion learnt some other way (a failed send, a missing room)"""
+    with _room_cache_lock:
+        _deleted_rooms.setdefault(room_id, {'deleted_at': deleted_at or time.time()})
+        _room_info_cache.pop(room_id, None)
+
+def room_gone(error_msg):
+    """True for a reply saying the room was deleted or doesn't exist (not for maintenance etc.)"""
+    error_msg = (error_msg or '').lower()
+    return 'deleted' in error_msg or 'not found' in error_msg
+
+def cache_room_info(room_id, room):
+    """Seed the room_info cache, e.g. from a join response; the room exists, so it isn't deleted"""
+    with _room_cache_lock:
+        _deleted_rooms.pop(room_id, None)
+        if room:
+            _room_info_cache[room_id] = (time.time(), room)
+
+def room_info_stale(room_id, max_age=ROOM_INFO_TTL):
+    cached = _room_info_cache.get(room_id)
+    return not cached or time.time() - cached[0] >= max_age
+
+def store_room_info(room_id, data):
+    """Cache a room_info response, returns (success, room or error message)"""
+    if data.get('status') == 'success':
+        cache_room_info(room_id, data.get('room'))
+        return True, data.get('room')
+    error_msg = data.get('message', 'Room not found')
+    if room_gone(error_msg):
+        mark_room_deleted(room_id)
+    return False, error_msg
+
+def forget_room_info(room_id):
+    """Members changed (join/leave): the next get_room_info goes to the server"""
+    with _room_cache_lock:
+        _room_info_cache.pop(room_id, None)
+
+def polling_room_metadata(room_id, polling=True):
+    with _room_cache_lock:
+        _metadata_polled[room_id] += 1 if polling else -1
+        if _metadata_polled[room_id] <= 0:
+            del _metadata_polled[room_id]
+
+def room_metadata_polled(room_id):
+    return _metadata_polled[room_id] > 0
+
+def check_room_deleted(room_id, refresh=False):
+    """(deleted, deleted_at) for a room, from the metadata cache while it's fresh (or polled)"""
+    if refresh or not room_metadata_polled(room_id):
+        get_deleted_rooms(0 if refresh else DELETED_ROOMS_TTL)
+    if room_id in _deleted_rooms:
+        return True, _deleted_rooms[room_id].get('deleted_at', time.time())
+    
+    # Rooms removed without showing up in the list only fail room_info
+    get_room_info(room_id, 0 if refresh else ROOM_INFO_TTL)
+    if room_id in _deleted_rooms:
+        return True, _deleted_rooms[room_id].get('deleted_at', time.time())
     
     return False, None
 
-def send_message(sender, message, room_id=None):
+def send_message(sender, message, room_id=None, client_id=None):
+    """Post one message, returns (True, type) or (False, reason)
+
+    reason is 'room_deleted', 'unreachable' (timeout, connection error,
+    server error: worth retrying) or the server's error message. client_id
+    lets servers that support it ignore a retried duplicate.
+    """
     payload = {
         'action': 'send_message',
         'sender': sender,
@@ -76,38 +532,79 @@ def send_message(sender, message, room_id=None):
     
     if room_id and room_id != "lobby":
         payload['room_id'] = room_id
+    if client_id:
+        payload['client_id'] = client_id
     
     try:
-        headers = {'Content-Type': 'application/json'}
-        response = requests.post(SERVER_URL, json=payload, headers=headers, timeout=5)
+        response = api_post(payload)
 
         if response.status_code == 200:
             try:
-                response_data = response.json()
-                if response_data.get('status') == 'success':
-                    return True, response_data.get('type', 'public')
-                else:
-                    error_msg = response_data.get('message', 'Error sending message')
-                    if 'Room has been deleted' in error_msg:
-                        return False, 'room_deleted'
-                    print(f"{RED}✗ {error_msg}{RESET}")
-                    return False, 'error'
-            except Exception as e:
-                print(f"{RED}✗ Invalid server response{RESET}")
-                return False, 'error'
+                return send_reply(response.json(), room_id)
+            except Exception:
+                return False, 'Invalid server response'
+        elif response.status_code >= 500:
+            return False, 'unreachable'
         else:
-            print(f"{RED}✗ Server error: {response.status_code}{RESET}")
-            return False, 'error'
-    except requests.exceptions.Timeout:
-        print(f"{RED}✗ Connection timeout{RESET}")
-        return False, 'error'
-    except Exception as e:
-        print(f"{RED}✗ Connection error: {str(e)}{RESET}")
-        return False, 'error'
+            return False, f"Server error: {response.status_code}"
+    except Exception:
+        return False, 'unreachable'
+
+def send_reply(response_data, room_id=None):
+    """(True, type) or (False, reason) for a send_message reply"""
+    if response_data.get('status') == 'success':
+        return True, response_data.get('type', 'public')
+    error_msg = response_data.get('message', 'Error sending message')
+    if 'Room has been deleted' in error_msg:
+        mark_room_deleted(room_id)
+        return False, 'room_deleted'
+    return False, error_msg
+
+def send_messages(items):
+    """Send queued messages in order, one (False, 'unreachable') or result each
+
+    Several go as one batch request when the server supports it. Sent one
+    by one, everything after a message that didn't get through stays
+    unsent, so nothing overtakes it.
+    """
+    global _batch_supported
+    
+    if len(items) > 1 and _batch_supported is not False:
+        payloads = []
+        for item in items:
+            payload = {'action': 'send_message', 'sender': item['sender'], 'message': item['text'], 'client_id': item['client_id']}
+            if item['room_id'] and item['room_id'] != "lobby":
+                payload['room_id'] = item['room_id']
+            payloads.append(payload)
+        try:
+            response = api_post({'action': 'batch', 'requests': payloads}, timeout=5 + len(items))
+            data = response.json() if response.status_code == 200 else None
+            if isinstance(data, dict) and isinstance(data.get('responses'), list) and len(data['responses']) == len(items):
+                _batch_supported = True
+                return [send_reply(reply, item['room_id']) if isinstance(reply, dict) else (False, 'unreachable')
+                        for item, reply in zip(items, data['responses'])]
+            if response.status_code >= 500:
+                return [(False, 'unreachable')] * len(items)
+            _batch_supported = False
+        except Exception:
+            return [(False, 'unreachable')] * len(items)
+    
+    results = []
+    for item in items:
+        results.append(send_message(item['sender'], item['text'], item['room_id'], item['client_id']))
+        if results[-1] == (False, 'unreachable'):
+            break
+    return results + [(False, 'unreachable')] * (len(items) - len(results))
+
+def server_reachable():
+    try:
+        return api_get({'action': 'messages', 'since': time.time()}, timeout=3).status_code == 200
+    except:
+        return False
 
 def get_user_rooms(username):
     try:
-        response = requests.get(SERVER_URL + f'?action=user_rooms&username={username}', timeout=5)
+        response = api_get({'action': 'user_rooms', 'username': username}, cache=True)
         if response.status_code == 200:
             data = response.json()
             if isinstance(data, dict) and data.get('status') == 'error':
@@ -126,8 +623,7 @@ def create_room(room_name, creator):
     }
     
     try:
-        headers = {'Content-Type': 'application/json'}
-        response = requests.post(SERVER_URL, json=payload, headers=headers, timeout=5)
+        response = api_post(payload)
         
         if response.status_code == 200:
             data = response.json()
@@ -158,16 +654,18 @@ def join_room(room_id, username):
     }
     
     try:
-        headers = {'Content-Type': 'application/json'}
-        response = requests.post(SERVER_URL, json=payload, headers=headers, timeout=5)
+        response = api_post(payload)
         
         if response.status_code == 200:
             data = response.json()
             if data.get('status') == 'success':
+                forget_room_info(room_id)
+                cache_room_info(room_id, data.get('room'))
                 return True, data
             else:
                 error_msg = data.get('message', 'Failed to join room')
                 if 'Room has been deleted' in error_msg:
+                    mark_room_deleted(room_id)
                     return False, {'message': 'Room has been deleted by admin'}
                 return False, {'message': error_msg}
         else:
@@ -185,12 +683,12 @@ def leave_room(room_id, username):
     }
     
     try:
-        headers = {'Content-Type': 'application/json'}
-        response = requests.post(SERVER_URL, json=payload, headers=headers, timeout=5)
+        response = api_post(payload)
         
         if response.status_code == 200:
             data = response.json()
             if data.get('status') == 'success':
+                forget_room_info(room_id)
                 return True, data.get('message', 'Left room')
             else:
                 error_msg = data.get('message', 'Failed to leave room')
@@ -202,16 +700,19 @@ def leave_room(room_id, username):
     except Exception as e:
         return False, f"Error: {str(e)}"
 
-def get_room_info(room_id):
+def get_room_info(room_id, max_age=ROOM_INFO_TTL):
+    """Room details, served from the cache for up to max_age seconds"""
+    if not room_info_stale(room_id, max_age):
+        return True, _room_info_cache[room_id][1]
+    if max_age and room_metadata_polled(room_id):
+        # Its receiver brings the info along with a poll (poll_room)
+        cached = _room_info_cache.get(room_id)
+        return (True, cached[1]) if cached else (False, "Room info not fetched yet")
+    
     try:
-        response = requests.get(SERVER_URL + f'?action=room_info&room_id={room_id}', timeout=5)
+        response = api_get({'action': 'room_info', 'room_id': room_id}, cache=True)
         if response.status_code == 200:
-            data = response.json()
-            if data.get('status') == 'success':
-                return True, data.get('room')
-            else:
-                error_msg = data.get('message', 'Room not found')
-                return False, error_msg
+            return store_room_info(room_id, response.json())
         else:
             return False, f"Server error: {response.status_code}"
     except requests.exceptions.Timeout:
@@ -219,43 +720,13 @@ def get_room_info(room_id):
     except Exception as e:
         return False, f"Error: {str(e)}"
 
-def get_room_messages(room_id):
-    try:
-        response = requests.get(SERVER_URL + f'?action=room_messages&room_id={room_id}', timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            if isinstance(data, dict) and data.get('status') == 'error':
-                error_msg = data.get('message', 'System error')
-                if 'maintenance' in error_msg.lower():
-                    print(f"{YELLOW}⚠️ {error_msg}{RESET}")
-                return []
-            return data
-        else:
-            return []
-    except requests.exceptions.Timeout:
-        print(f"{RED}✗ Connection timeout{RESET}")
-        return []
-    except:
-        return []
+def get_room_messages(room_id, since=None, wait=None, before=None, limit=None, report_errors=False):
+    params = {'action': 'room_messages', 'room_id': room_id}
+    return fetch_message_list(params, since, wait, before, limit, report_errors)
 
-def get_private_messages(username):
-    try:
-        response = requests.get(SERVER_URL + f'?action=private_messages&user={username}', timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            if isinstance(data, dict) and data.get('status') == 'error':
-                error_msg = data.get('message', 'System error')
-                if 'maintenance' in error_msg.lower():
-                    print(f"{YELLOW}⚠️ {error_msg}{RESET}")
-                return []
-            return data
-        else:
-            return []
-    except requests.exceptions.Timeout:
-        print(f"{RED}✗ Connection timeout{RESET}")
-        return []
-    except:
-        return []
+def get_private_messages(username, since=None, wait=None, before=None, limit=None, report_errors=False):
+    params = {'action': 'private_messages', 'user': username}
+    return fetch_message_list(params, since, wait, before, limit, report_errors)
 
 def login_or_signup():
     print("\n1. Login\n2. Signup")
@@ -271,8 +742,7 @@ def login_or_signup():
         }
         
         try:
-            headers = {'Content-Type': 'application/json'}
-            response = requests.post(SERVER_URL, json=payload, headers=headers, timeout=5)
+            response = api_post(payload)
             
             if response.status_code == 200:
                 data = response.json()
@@ -308,8 +778,7 @@ def login_or_signup():
         }
         
         try:
-            headers = {'Content-Type': 'application/json'}
-            response = requests.post(SERVER_URL, json=payload, headers=headers, timeout=5)
+            response = api_post(payload)
             
             if response.status_code == 200:
                 data = response.json()
@@ -330,175 +799,1760 @@ def login_or_signup():
             print(f"{RED}✗ Connection failed: {str(e)}{RESET}")
         return None
 
-def get_messages():
+def get_messages(since=None, wait=None, before=None, limit=None, report_errors=False):
+    params = {'action': 'messages'}
+    return fetch_message_list(params, since, wait, before, limit, report_errors)
+
+def fetch_message_list(params, since=None, wait=None, before=None, limit=None, report_errors=False):
+    """GET a message list through the HTTP cache, an empty FailedFetch on any failure"""
+    if since is not None:
+        params['since'] = since
+    if wait:
+        params['wait'] = wait
+    if before is not None:
+        params['before'] = before
+    if limit:
+        params['limit'] = limit
+    
     try:
-        response = requests.get(SERVER_URL + '?action=messages', timeout=5)
+        response = api_get(params, timeout=5 + (wait or 0), cache=True)
         if response.status_code == 200:
-            data = response.json()
+            data = decode_json(response.content)
             if isinstance(data, dict) and data.get('status') == 'error':
                 error_msg = data.get('message', 'System error')
-                if 'maintenance' in error_msg.lower():
-                    print(f"{YELLOW}⚠️ {error_msg}{RESET}")
-                return []
+                if report_errors and 'maintenance' in error_msg.lower():
+                    fetch_error(f"{YELLOW}⚠️ {error_msg}{RESET}")
+                return FailedFetch()
+            if report_errors:
+                fetch_error(None)
             return data
         else:
-            print(f"{RED}✗ Error fetching messages: {response.status_code}{RESET}")
-            return []
+            if report_errors:
+                fetch_error(f"{RED}✗ Error fetching messages: {response.status_code}{RESET}")
+            return FailedFetch()
     except requests.exceptions.Timeout:
-        print(f"{RED}✗ Connection timeout{RESET}")
-        return []
+        if report_errors:
+            fetch_error(f"{RED}✗ Connection timeout{RESET}")
+        return FailedFetch()
     except Exception as e:
-        print(f"{RED}✗ Connection error: {str(e)}{RESET}")
-        return []
+        if report_errors:
+            fetch_error(f"{RED}✗ Connection error: {str(e)}{RESET}")
+        return FailedFetch()
+
+_fetch_error_shown = None
+
+def fetch_error(message):
+    """Show a fetch error on the status line, or (None) take down the one shown once fetches work again"""
+    global _fetch_error_shown
+    with screen.lock:
+        if message is not None:
+            screen.status = _fetch_error_shown = message
+        elif _fetch_error_shown is not None:
+            if screen.status == _fetch_error_shown:
+                screen.status = ""
+            _fetch_error_shown = None
 
 # ============================================
-# FILE SHARING FUNCTIONS
+# MESSAGE RECORDS
 # ============================================
 
-def upload_file(sender, filepath, expire="24h", room_id=None, private_to=None):
-    """Upload and share a file"""
-    
-    if not os.path.exists(filepath):
-        print(f"{RED}✗ File not found: {filepath}{RESET}")
-        return False
+def decode_json(data):
+    """Parse a JSON document (bytes or str) with the fastest parser installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if ujson is not None:
+        return ujson.loads(data)
+    return json.loads(data)
+
+class Message:
+    """One chat message kept in a view, without the per-message dict of the JSON it came from
+
+    Fetches hand around the decoded dicts; merge_messages() turns only the
+    messages a view keeps into records. Reads like that dict
+    (message['sender'], message.get('timestamp', 0)), fields beyond the
+    usual ones are kept in `extra`. Sender and receiver names are interned;
+    `line` holds the screen line last formatted for it.
+    """
     
-    # Check file size (max 100MB)
-    file_size = os.path.getsize(filepath)
-    if file_size > 100 * 1024 * 1024:
-        print(f"{RED}✗ File too large. Max 100MB{RESET}")
-        return False
+    __slots__ = ('sender', 'receiver', 'message', 'timestamp', 'id', 'extra', 'line')
+    FIELDS = ('sender', 'receiver', 'message', 'timestamp', 'id')
     
-    # Read file and encode to base64
-    try:
-        with open(filepath, 'rb') as f:
-            file_content = f.read()
-            file_b64 = base64.b64encode(file_content).decode('utf-8')
-    except Exception as e:
-        print(f"{RED}✗ Error reading file: {str(e)}{RESET}")
-        return False
+    def __init__(self, data):
+        self.sender = intern_name(data.get('sender'))
+        self.receiver = intern_name(data.get('receiver'))
+        self.message = data.get('message')
+        self.timestamp = data.get('timestamp')
+        self.id = data.get('id')
+        self.extra = {key: value for key, value in data.items() if key not in Message.FIELDS} or None
+        self.line = None
     
-    filename = os.path.basename(filepath)
+    def get(self, key, default=None):
+        if key in Message.FIELDS:
+            value = getattr(self, key)
+        else:
+            value = self.extra.get(key) if self.extra else None
+        return default if value is None else value
     
-    # Show progress (simulated)
-    print(f"{YELLOW}⬆️ Uploading {filename}...{RESET}")
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
     
-    payload = {
-        'action': 'upload_file',
-        'sender': sender,
-        'filename': filename,
-        'filedata': file_b64,
-        'filesize': file_size,
-        'expire': expire
-    }
+    def to_dict(self):
+        data = {key: getattr(self, key) for key in Message.FIELDS if getattr(self, key) is not None}
+        if self.extra:
+            data.update((key, value) for key, value in self.extra.items() if value is not None)
+        return data
     
-    if room_id and room_id != "lobby":
-        payload['room_id'] = room_id
+    def __eq__(self, other):
+        if isinstance(other, Message):
+            return (self.timestamp, self.sender, self.receiver, self.message, self.id, self.extra) == \
+                   (other.timestamp, other.sender, other.receiver, other.message, other.id, other.extra)
+        if isinstance(other, dict):
+            return self.to_dict() == plain_message(other)
+        return NotImplemented
     
-    if private_to:
-        payload['private_to'] = private_to
+    __hash__ = None
     
-    try:
-        headers = {'Content-Type': 'application/json'}
-        response = requests.post(SERVER_URL, json=payload, headers=headers, timeout=30)  # Longer timeout for files
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('status') == 'success':
-                print(f"{GREEN}✓ File shared successfully! Code: {data.get('file_code')}{RESET}")
-                return True
-            else:
-                print(f"{RED}✗ {data.get('message', 'Upload failed')}{RESET}")
-                return False
-        else:
-            print(f"{RED}✗ Server error: {response.status_code}{RESET}")
-            return False
-    except requests.exceptions.Timeout:
-        print(f"{RED}✗ Upload timeout{RESET}")
+    def __repr__(self):
+        return f"Message({self.to_dict()!r})"
+
+def intern_name(name):
+    """One shared copy of a user name however many messages carry it"""
+    return sys.intern(name) if isinstance(name, str) else name
+
+def plain_message(message):
+    """A message (record or decoded dict) as a dict without null fields"""
+    if isinstance(message, Message):
+        return message.to_dict()
+    return {key: value for key, value in message.items() if value is not None}
+
+def to_messages(items):
+    return [item if isinstance(item, Message) else Message(item) for item in items if isinstance(item, (dict, Message))]
+
+def json_default(value):
+    """json.dumps fallback: records are written as the objects they came from"""
+    if isinstance(value, Message):
+        return value.to_dict()
+    return str(value)
+
+# ============================================
+# INCREMENTAL FETCHING
+# ============================================
+
+class FailedFetch(list):
+    """Empty result of a fetch that failed, told apart from an empty history"""
+
+def message_key(message):
+    """Identity of a message, used to de-duplicate overlapping fetches"""
+    if message.get('id') is not None:
+        return message['id']
+    return (message.get('timestamp', 0), message.get('sender'), message.get('receiver'), message.get('message'))
+
+def latest_timestamp(messages):
+    """Cursor for the next delta fetch (None means fetch everything)"""
+    if not messages:
+        return None
+    return max(message.get('timestamp', 0) for message in messages)
+
+def messages_fingerprint(messages, window=FINGERPRINT_WINDOW):
+    """Cheap identity of a message list: length, newest timestamp and a hash of the newest `window` messages"""
+    tail = json.dumps([plain_message(message) for message in messages[-window:]], sort_keys=True, default=str).encode('utf-8')
+    return len(messages), latest_timestamp(messages), hashlib.blake2b(tail, digest_size=8).digest()
+
+def is_full_history(fetched, since, messages):
+    """True when a fetch answered with the whole history: no cursor, or a reply reaching back to the oldest message held"""
+    if isinstance(fetched, FailedFetch):
         return False
-    except Exception as e:
-        print(f"{RED}✗ Upload error: {str(e)}{RESET}")
+    if since is None:
+        return True
+    if not messages or not fetched:
         return False
+    oldest = messages[0]
+    timestamp, key = oldest.get('timestamp', 0), message_key(oldest)
+    return any(message.get('timestamp', 0) == timestamp and message_key(message) == key for message in fetched)
+
+def reuse_records(fetched, messages):
+    """Records for a fetched history, keeping the ones already held for unchanged messages"""
+    known = {message_key(message): message for message in messages}
+    records = []
+    for item in fetched:
+        if not isinstance(item, (dict, Message)):
+            continue
+        record = known.get(message_key(item))
+        if record is None or record != item:
+            record = item if isinstance(item, Message) else Message(item)
+        records.append(record)
+    return records
+
+def merge_messages(messages, fetched, since, limit=None):
+    """Merge a poll result into the cached history, returns (messages, changed)
+    
+    Unseen messages are appended; a response that reaches back to the oldest
+    message held is the full history and replaces it. At most `limit` of the
+    newest messages are kept (None: no bound).
+    """
+    if isinstance(fetched, FailedFetch):
+        return messages, False
+    full = is_full_history(fetched, since, messages)
+    if limit:
+        fetched = fetched[-limit:]
+    
+    if full:
+        if messages_fingerprint(fetched) == messages_fingerprint(messages):
+            return messages, False
+        return reuse_records(fetched, messages), True
+    
+    known = {message_key(message): index for index, message in enumerate(messages)}
+    new_messages = []
+    edited = {}
+    for message in fetched:
+        index = known.get(message_key(message))
+        if index is None:
+            new_messages.append(message)
+        elif messages[index] != message:
+            # Same id, new content: edited on the server
+            edited[index] = to_messages([message])[0]
+    new_messages = to_messages(new_messages)
+    
+    if not new_messages and not edited:
+        return messages, False
+    merged = [edited.get(index, message) for index, message in enumerate(messages)] if edited else list(messages)
+    merged += new_messages
+    return (merged[-limit:] if limit else merged), True
+
+# ============================================
+# MESSAGE CACHE
+# ============================================
+
+_message_cache = None
+_message_cache_lock = threading.Lock()
 
-def download_file(file_code, username):
-    """Download a file by code"""
+def get_message_cache():
+    """Open (once) the SQLite history cache, None when disabled or unusable"""
+    global _message_cache
     
-    print(f"{YELLOW}⬇️ Fetching file info...{RESET}")
+    if not MESSAGE_CACHE_ENABLED:
+        return None
+    
+    with _message_cache_lock:
+        if _message_cache is None:
+            try:
+                os.makedirs(DATA_DIR, exist_ok=True)
+                db = sqlite3.connect(MESSAGE_CACHE_FILE, timeout=5, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS messages ("
+                    " view TEXT NOT NULL, key TEXT NOT NULL, timestamp REAL NOT NULL, data TEXT NOT NULL,"
+                    " PRIMARY KEY (view, key))"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS messages_by_time ON messages (view, timestamp)")
+                # Age-based eviction, once per run
+                db.execute("DELETE FROM messages WHERE timestamp < ?", (time.time() - MESSAGE_CACHE_MAX_AGE,))
+                db.commit()
+                _message_cache = db
+            except sqlite3.Error:
+                _message_cache = False
+        return _message_cache or None
+
+def cache_view_key(view):
+    kind, key = view
+    return kind if key is None else f"{kind}:{key}"
+
+def load_cached_messages(view, limit=None, before=None):
+    """Newest cached messages of a view (older than `before` if given), oldest first"""
+    db = get_message_cache()
+    if db is None:
+        return []
+    
+    query = "SELECT data FROM messages WHERE view = ?"
+    args = [cache_view_key(view)]
+    if before is not None:
+        query += " AND timestamp < ?"
+        args.append(before)
+    query += " ORDER BY timestamp DESC"
+    if limit:
+        query += " LIMIT ?"
+        args.append(limit)
     
     try:
-        response = requests.get(SERVER_URL + f'?action=download_file&file_code={file_code}&username={username}', timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            if data.get('status') == 'error':
-                print(f"{RED}✗ {data.get('message', 'Download failed')}{RESET}")
-                return False
-            
-            filename = data.get('filename', f"file_{file_code}")
-            filesize = data.get('filesize', 0)
-            filedata_b64 = data.get('filedata', '')
-            
-            # Decode
-            file_content = base64.b64decode(filedata_b64)
-            
-            # Save to current directory
-            save_path = os.path.join(os.getcwd(), filename)
-            
-            # If file exists, add number
-            counter = 1
-            original_filename = filename
-            while os.path.exists(save_path):
-                name, ext = os.path.splitext(original_filename)
-                filename = f"{name}_{counter}{ext}"
-                save_path = os.path.join(os.getcwd(), filename)
-                counter += 1
-            
-            print(f"{YELLOW}⬇️ Downloading {filename} ({format_file_size(filesize)})...{RESET}")
-            
-            with open(save_path, 'wb') as f:
-                f.write(file_content)
-            
-            print(f"{GREEN}✓ Downloaded to: {save_path}{RESET}")
-            return True
-            
-        else:
-            print(f"{RED}✗ Server error: {response.status_code}{RESET}")
-            return False
-            
-    except requests.exceptions.Timeout:
-        print(f"{RED}✗ Download timeout{RESET}")
-        return False
-    except Exception as e:
-        print(f"{RED}✗ Download error: {str(e)}{RESET}")
-        return False
+        with _message_cache_lock:
+            rows = db.execute(query, args).fetchall()
+        return [Message(decode_json(data)) for (data,) in reversed(rows)]
+    except (sqlite3.Error, ValueError):
+        return []
 
-def list_files(username):
-    """List all files user has access to"""
+def cache_messages(view, messages, replace=False, new=None):
+    """Store messages of a view
+
+    replace=True means messages is the server's full history from its oldest
+    timestamp on: cached messages in that range that aren't in it are dropped
+    (all of them for an empty history). Only `new` are written, if given.
+    """
+    db = get_message_cache()
+    if db is None:
+        return
+    
+    view_key = cache_view_key(view)
+    rows = [(view_key, json.dumps(message_key(message)), message.get('timestamp', 0), json.dumps(message, default=json_default))
+            for message in (messages if new is None else new)]
     
     try:
-        response = requests.get(SERVER_URL + f'?action=list_files&username={username}', timeout=5)
-        
-        if response.status_code == 200:
-            files = response.json()
-            
-            if not files:
-                print(f"{GRAY}No files found.{RESET}")
-                return
-            
-            print(f"\n{CYAN}════════════════════════════════════════════════════{RESET}")
-            print(f"{YELLOW}SHARED FILES{RESET}")
-            print(f"{CYAN}════════════════════════════════════════════════════{RESET}")
-            
-            current_time = time.time()
-            
-            for code, file in files.items():
-                # Format expiration
-                expires = file.get('expires')
-                expire_text = ""
-                if expires:
-                    hours_left = round((expires - current_time) / 3600, 1)
-                    if hours_left > 0:
-                        expire_text = f" {GRAY}(expires in {hours_left}h){RESET}"
+        with _message_cache_lock, db:
+            if replace and not messages:
+                db.execute("DELETE FROM messages WHERE view = ?", (view_key,))
+            elif replace:
+                oldest = min(message.get('timestamp', 0) for message in messages)
+                kept = {json.dumps(message_key(message)) for message in messages}
+                cached = db.execute("SELECT key FROM messages WHERE view = ? AND timestamp >= ?", (view_key, oldest)).fetchall()
+                db.executemany("DELETE FROM messages WHERE view = ? AND key = ?", [(view_key, key) for (key,) in cached if key not in kept])
+            if rows:
+                db.executemany("INSERT OR REPLACE INTO messages (view, key, timestamp, data) VALUES (?, ?, ?, ?)", rows)
+                # Size-based eviction: only the newest MESSAGE_CACHE_PER_VIEW per view
+                count, = db.execute("SELECT COUNT(*) FROM messages WHERE view = ?", (view_key,)).fetchone()
+                if count > MESSAGE_CACHE_PER_VIEW:
+                    db.execute(
+                        "DELETE FROM messages WHERE view = ? AND rowid NOT IN"
+                        " (SELECT rowid FROM messages WHERE view = ? ORDER BY timestamp DESC LIMIT ?)",
+                        (view_key, view_key, MESSAGE_CACHE_PER_VIEW)
+                    )
+    except sqlite3.Error:
+        pass
+
+class DaemonPool(Executor):
+    """Thread pool of up to max_workers daemon threads, so unfinished calls never hold up exit"""
+    
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.jobs = queue.Queue()
+        self.threads = 0
+        self.idle = 0
+        self.lock = threading.Lock()
+    
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        with self.lock:
+            self.jobs.put((future, func, args, kwargs))
+            if self.idle:
+                self.idle -= 1
+            elif self.threads < self.max_workers:
+                self.threads += 1
+                threading.Thread(target=self._work, daemon=True).start()
+        return future
+    
+    def _work(self):
+        while True:
+            future, func, args, kwargs = self.jobs.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            with self.lock:
+                self.idle += 1
+
+# One writer: cache writes stay in order, and one blocked on the SQLite
+# lock doesn't hold up exit
+_cache_writer = DaemonPool(1)
+
+def cache_messages_later(view, messages, **kwargs):
+    """cache_messages() on the cache writer thread: off the chat loop, and in order"""
+    if MESSAGE_CACHE_ENABLED:
+        _cache_writer.submit(cache_messages, view, messages, **kwargs)
+
+def new_records(merged, messages):
+    """The records of a merge result that weren't held before it (new or edited)"""
+    held = {id(message) for message in messages}
+    return [message for message in merged if id(message) not in held]
+
+class MessageStore:
+    """Messages of the view on screen and the recently used ones, in one place
+
+    Views are keyed like current_view() and hold their records oldest
+    first, so a view's messages exist once however many parts of the
+    client look at them.
+    """
+    
+    def __init__(self):
+        self.views = {}
+    
+    def get(self, view):
+        return self.views.get(view, [])
+    
+    def set(self, view, messages):
+        self.views[view] = messages
+    
+    def drop(self, view):
+        self.views.pop(view, None)
+    
+    def keep(self, views):
+        """Forget every view not in `views`"""
+        for view in list(self.views):
+            if view not in views:
+                del self.views[view]
+    
+    def count(self):
+        return sum(len(messages) for messages in self.views.values())
+
+message_store = MessageStore()
+
+class ViewCache:
+    """In-memory state of recently used views, least recently used evicted first
+
+    Each entry holds the view's room info (rooms only), when it was last
+    shown and when its data was last brought up to date; the messages
+    themselves stay in message_store.
+    """
+    
+    def __init__(self, size=VIEW_CACHE_SIZE, ttl=VIEW_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+    
+    def get(self, view):
+        entry = self.entries.get(view)
+        if entry is None:
+            return None
+        if time.time() - entry['used'] > self.ttl:
+            del self.entries[view]
+            return None
+        entry['used'] = time.time()
+        self.entries.move_to_end(view)
+        return entry
+    
+    def put(self, view, room_info=None):
+        """Remember a view being left"""
+        now = time.time()
+        self.entries[view] = {'room_info': room_info, 'used': now, 'refreshed': now}
+        self.entries.move_to_end(view)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+    
+    def update(self, view, room_info=None):
+        """Note a refresh, unless the view was dropped meanwhile"""
+        entry = self.entries.get(view)
+        if entry is not None:
+            entry['room_info'] = room_info or entry['room_info']
+            entry['refreshed'] = time.time()
+    
+    def drop(self, view):
+        self.entries.pop(view, None)
+    
+    def due(self, current, interval=VIEW_REFRESH_INTERVAL):
+        """Views (other than the one on screen) to refresh now; expired ones are dropped"""
+        now = time.time()
+        for view, entry in list(self.entries.items()):
+            if now - entry['used'] > self.ttl:
+                del self.entries[view]
+            elif view != current and now - entry['refreshed'] >= interval:
+                yield view, entry
+
+view_cache = ViewCache()
+
+# ============================================
+# RECEIVE TRANSPORTS
+# ============================================
+
+def current_view(username):
+    """Key of the view being displayed: (kind, id)"""
+    if current_mode == "private":
+        return ("private", username)
+    if current_mode == "room":
+        return ("room", current_room_id)
+    return ("public", None)
+
+def fetch_view_messages(view, since=None, wait=None, before=None, limit=None, report_errors=False):
+    kind, key = view
+    if kind == "private":
+        return get_private_messages(key, since=since, wait=wait, before=before, limit=limit, report_errors=report_errors)
+    if kind == "room":
+        return get_room_messages(key, since=since, wait=wait, before=before, limit=limit, report_errors=report_errors)
+    return get_messages(since=since, wait=wait, before=before, limit=limit, report_errors=report_errors)
+
+def fetch_view_history(view, before, limit=HISTORY_PAGE):
+    """Up to `limit` messages older than `before`, oldest first
+
+    Servers that don't page (no before/limit support) send the full
+    history, which is cut down here.
+    """
+    fetched = fetch_view_messages(view, before=before, limit=limit)
+    return to_messages([message for message in fetched if message.get('timestamp', 0) < before][-limit:])
+
+class PollScheduler:
+    """Decides how long the receive transports wait between requests"""
+    
+    def __init__(self):
+        self.interval = refresh_interval
+        self.errors = 0
+        self.cycle_failed = False
+        self.woken = threading.Event()
+    
+    def begin(self):
+        self.cycle_failed = False
+    
+    def failed(self):
+        self.cycle_failed = True
+    
+    def done(self, got_new):
+        """Account for one request cycle started with begin()"""
+        if self.cycle_failed:
+            self.errors += 1
+        elif got_new:
+            self.errors = 0
+            self.interval = POLL_MIN_INTERVAL
+        else:
+            self.errors = 0
+            self.interval = min(self.interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+    
+    def next_delay(self):
+        if self.errors:
+            delay = min(refresh_interval * 2 ** self.errors, POLL_ERROR_MAX_INTERVAL)
+        else:
+            delay = self.interval
+        return delay * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+    
+    def wake(self):
+        """User activity: poll soon, and fast for a while"""
+        self.interval = POLL_MIN_INTERVAL
+        self.woken.set()
+    
+    def wait(self, stopped):
+        started = time.time()
+        self.woken.wait(self.next_delay())
+        self.woken.clear()
+        # Woken early: still at most one request per POLL_MIN_INTERVAL
+        remaining = POLL_MIN_INTERVAL - (time.time() - started)
+        if remaining > 0:
+            stopped.wait(remaining)
+
+poll_scheduler = PollScheduler()
+
+def has_newer(messages, since):
+    if since is None:
+        return bool(messages)
+    return any(message.get('timestamp', 0) > since for message in messages)
+
+def message_params(view, since=None, wait=None):
+    """Request params fetching a view's messages"""
+    kind, key = view
+    if kind == "private":
+        params = {'action': 'private_messages', 'user': key}
+    elif kind == "room":
+        params = {'action': 'room_messages', 'room_id': key}
+    else:
+        params = {'action': 'messages'}
+    if since is not None:
+        params['since'] = since
+    if wait:
+        params['wait'] = wait
+    return params
+
+def poll_room(room_id, since=None, wait=None):
+    """One poll cycle of a room: new messages plus any room metadata that
+    has gone stale (deleted rooms, room info), batched into one round-trip
+    """
+    calls = [message_params(("room", room_id), since, wait)]
+    if deleted_rooms_stale():
+        calls.append({'action': 'deleted_rooms'})
+    if room_info_stale(room_id):
+        calls.append({'action': 'room_info', 'room_id': room_id})
+    if len(calls) == 1:
+        return get_room_messages(room_id, since=since, wait=wait, report_errors=True)
+    
+    results = api_batch(calls, timeout=5 + (wait or 0))
+    for params, data in zip(calls[1:], results[1:]):
+        if params['action'] == 'deleted_rooms':
+            store_deleted_rooms(data)
+        elif isinstance(data, dict):
+            store_room_info(room_id, data)
+    
+    fetched = results[0]
+    if isinstance(fetched, dict) and fetched.get('status') == 'error':
+        error_msg = fetched.get('message', 'System error')
+        if 'maintenance' in error_msg.lower():
+            fetch_error(f"{YELLOW}⚠️ {error_msg}{RESET}")
+        return FailedFetch()
+    if not isinstance(fetched, list):
+        fetch_error(f"{RED}✗ Error fetching messages{RESET}")
+        return FailedFetch()
+    fetch_error(None)
+    return fetched
+
+def poll_view(view, since, wait=None):
+    """One receive cycle's fetch, a failure counting towards poll_scheduler's error backoff"""
+    if view[0] == "room":
+        fetched = poll_room(view[1], since, wait)
+    else:
+        fetched = fetch_view_messages(view, since, wait=wait, report_errors=True)
+    if isinstance(fetched, FailedFetch):
+        poll_scheduler.failed()
+    return fetched
+
+def room_polling(transport):
+    """Mark a polling transport's room as having its metadata refreshed by poll_room while it runs"""
+    @functools.wraps(transport)
+    def run(view, since, stopped):
+        if view[0] != "room":
+            yield from transport(view, since, stopped)
+            return
+        polling_room_metadata(view[1])
+        try:
+            yield from transport(view, since, stopped)
+        finally:
+            polling_room_metadata(view[1], False)
+    return run
+
+@room_polling
+def poll_transport(view, since, stopped):
+    """Adaptive-interval polling, works with any server"""
+    while not stopped.is_set():
+        poll_scheduler.begin()
+        fetched = poll_view(view, since)
+        poll_scheduler.done(has_newer(fetched, since))
+        yield fetched, since
+        since = latest_timestamp(fetched) or since
+        poll_scheduler.wait(stopped)
+
+@room_polling
+def longpoll_transport(view, since, stopped):
+    """Server holds each request until something newer than the cursor arrives"""
+    while not stopped.is_set():
+        started = time.time()
+        poll_scheduler.begin()
+        fetched = poll_view(view, since, wait=LONG_POLL_WAIT)
+        got_new = has_newer(fetched, since)
+        poll_scheduler.done(got_new)
+        yield fetched, since
+        since = latest_timestamp(fetched) or since
+        
+        # A server that doesn't hold requests answers at once: pace like polling
+        if poll_scheduler.cycle_failed or not got_new and time.time() - started < 1:
+            poll_scheduler.wait(stopped)
+
+def stream_transport(view, since, stopped):
+    """Long-lived NDJSON (or SSE) response, one message per line"""
+    kind, key = view
+    params = {'action': 'stream'}
+    if kind == "private":
+        params['user'] = key
+    elif kind == "room":
+        params['room_id'] = key
+    
+    while not stopped.is_set():
+        if since is not None:
+            params['since'] = since
+        
+        poll_scheduler.begin()
+        try:
+            response = api_get(params, timeout=(5, STREAM_IDLE_TIMEOUT), stream=True)
+        except Exception:
+            # Unreachable: try the stream again, backing off while it keeps failing
+            poll_scheduler.failed()
+            poll_scheduler.done(False)
+            poll_scheduler.wait(stopped)
+            continue
+        
+        content_type = response.headers.get('Content-Type', '')
+        if response.status_code != 200 or not ('ndjson' in content_type or 'event-stream' in content_type):
+            # Answered without streaming support: long-poll instead
+            response.close()
+            yield from longpoll_transport(view, since, stopped)
+            return
+        
+        # Only a stream that delivers something (a message or a heartbeat)
+        # ends the reconnect backoff
+        received = False
+        try:
+            with response:
+                for line in response.iter_lines():
+                    if stopped.is_set():
+                        return
+                    if not received:
+                        received = True
+                        poll_scheduler.done(True)
+                    line = line.strip()
+                    if line.startswith(b'data:'):
+                        line = line[5:].strip()
+                    if not line or line.startswith(b':'):
+                        continue
+                    message = decode_json(line)
+                    yield [message], message.get('timestamp', 0)
+                    since = max(since or 0, message.get('timestamp', 0))
+        except Exception:
+            pass
+        
+        # Dropped or ended (by the server or a proxy): reconnect from the
+        # cursor, paced like polling
+        if not received:
+            poll_scheduler.failed()
+            poll_scheduler.done(False)
+        poll_scheduler.wait(stopped)
+
+RECEIVE_TRANSPORTS = {
+    "poll": poll_transport,
+    "longpoll": longpoll_transport,
+    "stream": stream_transport,
+}
+
+class MessageReceiver(threading.Thread):
+    """Runs the receive transport for one view, calling deliver(view, messages, since)"""
+    
+    def __init__(self, view, since, deliver, mode=None):
+        super().__init__(daemon=True)
+        self.view = view
+        self.since = since
+        self.deliver = deliver
+        self.transport = RECEIVE_TRANSPORTS.get(mode or RECEIVE_MODE, poll_transport)
+        self.stopped = threading.Event()
+    
+    def run(self):
+        batches = self.transport(self.view, self.since, self.stopped)
+        try:
+            for fetched, since in batches:
+                if self.stopped.is_set():
+                    break
+                self.deliver(self.view, fetched, since)
+        finally:
+            batches.close()
+    
+    def stop(self):
+        # An in-flight request finishes on its own, its result is dropped
+        self.stopped.set()
+        poll_scheduler.woken.set()
+
+# ============================================
+# SEND QUEUE
+# ============================================
+
+_outbox_lock = threading.Lock()
+
+def outbox_add(*entries):
+    with _outbox_lock:
+        outbox = load_json_file(OUTBOX_FILE)
+        outbox.setdefault('entries', []).extend(entries)
+        save_json_file(OUTBOX_FILE, outbox)
+
+def outbox_remove(entry_id):
+    with _outbox_lock:
+        outbox = load_json_file(OUTBOX_FILE)
+        entries = outbox.get('entries', [])
+        outbox['entries'] = [entry for entry in entries if entry.get('id') != entry_id]
+        if len(outbox['entries']) != len(entries):
+            save_json_file(OUTBOX_FILE, outbox)
+
+def outbox_entries(sender, kind):
+    """A user's waiting messages or shares, oldest first"""
+    with _outbox_lock:
+        entries = load_json_file(OUTBOX_FILE).get('entries', [])
+    return [entry for entry in entries if entry.get('sender') == sender and entry.get('kind') == kind]
+
+class SendQueue:
+    """Outgoing messages, sent in order by a background thread
+
+    Each message shows up at once as a local echo (pending, then sent,
+    failed or offline) until the server's copy arrives with a fetch. Until
+    it's through it is also kept in the outbox, so messages typed while the
+    server can't be reached go out once it can, even after a restart.
+    """
+    
+    def __init__(self):
+        self.items = []
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.worker = None
+        self.kick = threading.Event()
+        self.notify = None
+    
+    def submit(self, sender, text, room_id, view, client_id=None, created=None):
+        item = {
+            'sender': sender,
+            'text': text,
+            'room_id': room_id,
+            'view': view,
+            'status': 'pending',
+            'created': created or time.time(),
+            'client_id': client_id or f"{sender}-{time.time_ns()}",
+            # New ones are written to the outbox by the worker, off the chat loop
+            'saved': client_id is not None
+        }
+        with self.lock:
+            self.items.append(item)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+        self.queue.put(item)
+        # Waiting for the server to come back: a new message tries right away
+        self.kick.set()
+        return item
+    
+    def restore(self, sender):
+        """Queue what an earlier run left in the outbox, returns how many"""
+        entries = outbox_entries(sender, 'message')
+        for entry in entries:
+            self.submit(sender, entry['text'], entry['room_id'], tuple(entry['view']), entry['id'], entry['created'])
+        return len(entries)
+    
+    def run(self):
+        pending = []
+        attempt = 0
+        while True:
+            if not pending:
+                pending.append(self.queue.get())
+            # Whatever else is waiting goes along, in order
+            while True:
+                try:
+                    pending.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.save(pending)
+            
+            batch = pending[:SEND_BATCH_SIZE]
+            for item, (ok, detail) in zip(batch, send_messages(batch)):
+                if not ok and detail == 'unreachable':
+                    break
+                pending.remove(item)
+                attempt = 0
+                item['status'] = 'sent' if ok else 'failed'
+                item['detail'] = detail
+                item['sent_at'] = time.time()
+                outbox_remove(item['client_id'])
+                self.queue.task_done()
+                self.changed(item)
+            else:
+                continue
+            
+            # Not through: the rest keeps its place and is retried, quickly
+            # at first, then every OUTBOX_RETRY_INTERVAL
+            attempt += 1
+            if attempt <= SEND_RETRIES:
+                delay = SEND_RETRY_BACKOFF * 2 ** (attempt - 1)
+            else:
+                delay = OUTBOX_RETRY_INTERVAL * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+                for item in pending:
+                    if item['status'] != 'offline':
+                        item['status'] = 'offline'
+                        item['detail'] = 'unreachable'
+                        self.changed(item)
+            self.kick.clear()
+            self.kick.wait(delay)
+    
+    def save(self, items):
+        """Put messages not in the outbox yet there, in one write"""
+        unsaved = [item for item in items if not item['saved']]
+        if unsaved:
+            outbox_add(*[{'id': item['client_id'], 'kind': 'message', 'sender': item['sender'], 'text': item['text'],
+                          'room_id': item['room_id'], 'view': list(item['view']), 'created': item['created']}
+                         for item in unsaved])
+            for item in unsaved:
+                item['saved'] = True
+    
+    def changed(self, item):
+        if self.notify:
+            self.notify(item)
+    
+    def echoes(self, view):
+        """Display copies of this view's messages not yet fetched back"""
+        echoes = []
+        with self.lock:
+            for item in self.items:
+                if item['view'] != view:
+                    continue
+                echo = {'sender': item['sender'], 'message': item['text'], 'timestamp': item['created'], 'status': item['status']}
+                if view[0] == "private":
+                    # '@john,@maria hi' is stored per recipient as 'hi'
+                    recipients = re.match(r'^(@\S+\s*)+', item['text'])
+                    echo['receiver'] = ", ".join(re.findall(r'@(\w+)', recipients.group(0))) if recipients else ""
+                    echo['message'] = item['text'][recipients.end():] if recipients else item['text']
+                echoes.append(echo)
+        return echoes
+    
+    def settle(self, view, messages):
+        """Drop echoes of sent messages whose server copy is in `messages`, or that have been up SENT_ECHO_TTL"""
+        with self.lock:
+            sent = [item for item in self.items if item['view'] == view and item['status'] == 'sent']
+            if not sent:
+                return
+            client_ids = {message.get('client_id') for message in messages} - {None}
+            now = time.time()
+            for item in sent:
+                if item['client_id'] in client_ids or now - item['sent_at'] > SENT_ECHO_TTL:
+                    self.items.remove(item)
+                    continue
+                if client_ids:
+                    # The server returns client ids: this one hasn't come back yet
+                    continue
+                text = re.sub(r'^(@\S+\s*)+', '', item['text']) if view[0] == "private" else item['text']
+                if any(message.get('sender') == item['sender'] and message.get('message') == text
+                       and message.get('timestamp', 0) >= item['created'] - 60 for message in messages):
+                    self.items.remove(item)
+    
+    def forget_failed(self):
+        with self.lock:
+            self.items = [item for item in self.items if item['status'] != 'failed']
+    
+    def unsent(self):
+        return self.queue.unfinished_tasks
+    
+    def wait_sent(self, timeout):
+        """Give queued messages up to `timeout` seconds to go out, True when none are left"""
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.1)
+        return not self.queue.unfinished_tasks
+
+send_queue = SendQueue()
+
+# ============================================
+# FILE SHARING FUNCTIONS
+# ============================================
+
+def draw_progress(label, done, total, started, initial=0):
+    """Redraw a one-line progress bar in place (initial = bytes done before this session)"""
+    width = 24
+    fraction = min(done / total, 1) if total else 1
+    filled = int(width * fraction)
+    speed = int((done - initial) / max(time.time() - started, 0.001))
+    bar = "█" * filled + "░" * (width - filled)
+    sys.stdout.write(f"\r\033[K{YELLOW}{label}{RESET} [{bar}] {int(fraction * 100)}% "
+                     f"{format_file_size(done)}/{format_file_size(total)} {GRAY}{format_file_size(speed)}/s{RESET}")
+    sys.stdout.flush()
+
+def read_chunks(filepath, chunk_size, offset=0):
+    """Yield (offset, bytes) pieces of a file without loading it whole"""
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield offset, chunk
+            offset += len(chunk)
+
+def read_part(filepath, offset, length):
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+def file_sha256(filepath):
+    digest = hashlib.sha256()
+    for _, chunk in read_chunks(filepath, DOWNLOAD_PART_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def is_compressible(filename):
+    """False for files that are already compressed (images, archives...)"""
+    if COMPRESSION_LEVEL <= 0:
+        return False
+    mimetype, encoding = mimetypes.guess_type(filename)
+    if encoding:
+        # .gz, .bz2, .xz...
+        return False
+    if mimetype == 'image/svg+xml' or mimetype == 'image/bmp':
+        return True
+    return not (mimetype and mimetype.startswith(COMPRESSED_MIMETYPES))
+
+def load_json_file(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_json_file(path, data):
+    """Replace a JSON state file atomically: a crash or full disk mid-write leaves the old one"""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+# Uploads running on different workers share UPLOAD_STATE_FILE
+_upload_state_lock = threading.Lock()
+
+# ============================================
+# TRANSFER ENGINE
+# ============================================
+
+class TransferCancelled(Exception):
+    pass
+
+class Transfer:
+    """One upload or download, tracked in active_transfers
+
+    Workers call checkpoint() between chunks, which is where pause and
+    cancel take effect. A transfer paused while still queued is parked
+    instead, so it doesn't hold up a worker; resume or cancel requeues it.
+    """
+    
+    def __init__(self, kind, name, total=0):
+        self.id = next(_transfer_ids)
+        self.kind = kind
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.initial = 0
+        self.started = time.time()
+        self.paused_at = None
+        self.paused_for = 0
+        self.finished_at = None
+        self.status = "running"
+        self.lock = threading.Lock()
+        self.unpaused = threading.Event()
+        self.unpaused.set()
+        self.quiet = False
+        self.file_code = None
+        self.saved_to = None
+        self.error = None
+        self.parked = None
+        active_transfers[self.id] = self
+    
+    def advance(self, nbytes):
+        with self.lock:
+            self.done += nbytes
+    
+    def active_time(self):
+        now = self.finished_at or time.time()
+        paused_for = self.paused_for
+        if self.paused_at:
+            paused_for += now - self.paused_at
+        return max(now - self.started - paused_for, 0.001)
+    
+    def speed(self):
+        return (self.done - self.initial) / self.active_time()
+    
+    def eta(self):
+        speed = self.speed()
+        if not self.total or speed <= 0:
+            return None
+        return max(self.total - self.done, 0) / speed
+    
+    def draw(self):
+        if self.quiet:
+            return
+        arrow = "⬆️" if self.kind == "upload" else "⬇️"
+        draw_progress(f"{arrow} {self.name}", self.done, self.total, time.time() - self.active_time(), self.initial)
+    
+    def checkpoint(self):
+        """Block while paused, raise TransferCancelled once cancelled"""
+        self.unpaused.wait()
+        if self.status == "cancelled":
+            raise TransferCancelled()
+    
+    def pause(self):
+        if self.status in ("running", "queued"):
+            self.status = "paused"
+            self.paused_at = time.time()
+            self.unpaused.clear()
+            return True
+        return False
+    
+    def resume(self):
+        if self.status == "paused":
+            self.paused_for += time.time() - self.paused_at
+            self.paused_at = None
+            self.status = "running"
+            self.unpaused.set()
+            self.release()
+            return True
+        return False
+    
+    def cancel(self):
+        if self.status in ("running", "queued", "paused"):
+            self.status = "cancelled"
+            self.finished_at = time.time()
+            self.unpaused.set()
+            self.release()
+            return True
+        return False
+    
+    def park(self, requeue):
+        """Hold a job that is paused before it started; False when it isn't paused (anymore)"""
+        with self.lock:
+            if self.status != "paused":
+                return False
+            self.parked = requeue
+            return True
+    
+    def release(self):
+        """Requeue a parked job"""
+        with self.lock:
+            requeue, self.parked = self.parked, None
+        if requeue:
+            requeue()
+    
+    def finish(self, ok):
+        if self.status != "cancelled":
+            self.status = "done" if ok else "failed"
+            self.finished_at = time.time()
+        return ok
+
+def transfer_note(transfer, line):
+    """Print a progress or result line, unless the transfer runs queued in the background"""
+    if transfer is None or not transfer.quiet:
+        print(line)
+
+def transfer_error(transfer, message):
+    """Report a failure: printed, and kept for the status line of a background transfer"""
+    if transfer is not None:
+        transfer.error = message
+    transfer_note(transfer, f"{RED}✗ {message}{RESET}")
+    return False
+
+class TransferManager:
+    """Runs queued uploads/downloads on TRANSFER_WORKERS background threads"""
+    
+    def __init__(self, workers=TRANSFER_WORKERS):
+        self.jobs = queue.Queue()
+        self.workers = workers
+        self.threads = []
+    
+    def submit(self, transfer, func, *args, on_done=None):
+        """Queue func(*args, transfer=transfer); on_done(transfer) runs when it ends"""
+        transfer.status = "queued"
+        transfer.quiet = True
+        self.jobs.put((transfer, func, args, on_done))
+        
+        if len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return transfer
+    
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            transfer, func, args, on_done = job
+            
+            # Paused while queued: set it aside rather than block this worker
+            if transfer.park(lambda job=job: self.jobs.put(job)):
+                continue
+            
+            try:
+                transfer.checkpoint()
+                transfer.status = "running"
+                transfer.started = time.time()
+                ok = func(*args, transfer=transfer)
+                if transfer.status in ("running", "paused"):
+                    # Bailed out before moving any bytes (missing file, bad code...)
+                    transfer.finish(bool(ok))
+            except TransferCancelled:
+                transfer_note(transfer, f"\n{YELLOW}✗ Transfer #{transfer.id} ({transfer.name}) cancelled{RESET}")
+            except Exception as e:
+                transfer.finish(False)
+                transfer_error(transfer, f"Transfer #{transfer.id} failed: {str(e)}")
+            
+            if on_done:
+                on_done(transfer)
+
+transfer_manager = TransferManager()
+
+def run_parts(transfer, parts, move_part):
+    """Move (offset, length) parts concurrently, retrying each one on its own
+
+    move_part returns None on success and an error message (or raises) on
+    failure. Returns None once every part made it, else the error that
+    exhausted a part's retries.
+    """
+    def attempt(part):
+        error = None
+        for attempt_no in range(TRANSFER_PART_RETRIES + 1):
+            transfer.checkpoint()
+            try:
+                error = move_part(*part)
+            except TransferCancelled:
+                raise
+            except Exception as e:
+                error = str(e)
+            if not error:
+                return None
+            time.sleep(HTTP_RETRY_BACKOFF * 2 ** attempt_no)
+        return error
+    
+    with ThreadPoolExecutor(max_workers=TRANSFER_CONCURRENCY) as pool:
+        futures = [pool.submit(attempt, part) for part in parts]
+        for future in as_completed(futures):
+            try:
+                error = future.result()
+            except TransferCancelled:
+                for pending in futures:
+                    pending.cancel()
+                raise
+            if error:
+                for pending in futures:
+                    pending.cancel()
+                return error
+            transfer.draw()
+    
+    return None
+
+# ============================================
+# UPLOADS
+# ============================================
+
+class Base64JSONBody:
+    """JSON upload body that base64-encodes the file while it is being sent
+
+    Produces the same payload as json.dumps({..., 'filedata': b64}) but only
+    ever holds one chunk in memory; __len__ lets requests send Content-Length.
+    """
+    
+    # Multiple of 3 so chunks encode without padding in the middle
+    CHUNK_SIZE = 3 * 64 * 1024
+    
+    def __init__(self, payload, filepath, file_size, on_progress=None):
+        self.prefix = (json.dumps(payload)[:-1] + ', "filedata": "').encode('utf-8')
+        self.suffix = b'"}'
+        self.filepath = filepath
+        self.file_size = file_size
+        self.on_progress = on_progress
+    
+    def __len__(self):
+        return len(self.prefix) + 4 * math.ceil(self.file_size / 3) + len(self.suffix)
+    
+    def __iter__(self):
+        yield self.prefix
+        for offset, chunk in read_chunks(self.filepath, self.CHUNK_SIZE):
+            yield base64.b64encode(chunk)
+            if self.on_progress:
+                self.on_progress(len(chunk))
+        yield self.suffix
+
+def upload_file_chunked(filepath, meta, transfer):
+    """Resumable upload in UPLOAD_CHUNK_SIZE parts, TRANSFER_CONCURRENCY at a time
+
+    Returns None when the server doesn't support chunked uploads, otherwise
+    True/False. Every part carries its SHA-256 and the server checks the
+    whole-file hash on completion. An interrupted upload resumes with the
+    missing parts the next time the same file is shared to the same place.
+    Compressible files are offered as gzip; if the server agrees, each part
+    is sent gzipped whenever that makes it smaller.
+    """
+    file_size = meta['filesize']
+    stat = os.stat(filepath)
+    resume_key = f"{os.path.abspath(filepath)}|{file_size}|{int(stat.st_mtime)}|{meta.get('room_id', '')}|{meta.get('private_to', '')}"
+    
+    with _upload_state_lock:
+        upload_id = load_json_file(UPLOAD_STATE_FILE).get(resume_key)
+    received = set()
+    compression = None
+    
+    if upload_id:
+        try:
+            status = api_get({'action': 'upload_status', 'upload_id': upload_id}).json()
+        except Exception:
+            status = {}
+        if status.get('status') == 'success':
+            received = set(status.get('offsets', []))
+            compression = status.get('compression')
+            transfer_note(transfer, f"{GRAY}Resuming upload ({len(received)} parts already sent){RESET}")
+        else:
+            upload_id = None
+    
+    if not upload_id:
+        try:
+            init = dict(meta, action='upload_init', chunk_size=UPLOAD_CHUNK_SIZE)
+            if is_compressible(meta['filename']):
+                init['compression'] = 'gzip'
+            response = api_post(init)
+            data = response.json() if response.status_code == 200 else {}
+        except ValueError:
+            data = {}
+        except requests.exceptions.RequestException as e:
+            return transfer_error(transfer, f"Upload error: {str(e)}")
+        
+        if not isinstance(data, dict) or data.get('status') != 'success' or not data.get('upload_id'):
+            return None
+        
+        upload_id = data['upload_id']
+        compression = data.get('compression')
+        with _upload_state_lock:
+            state = load_json_file(UPLOAD_STATE_FILE)
+            state[resume_key] = upload_id
+            save_json_file(UPLOAD_STATE_FILE, state)
+    
+    parts = []
+    for offset in range(0, file_size, UPLOAD_CHUNK_SIZE):
+        length = min(UPLOAD_CHUNK_SIZE, file_size - offset)
+        if offset in received:
+            transfer.initial += length
+        else:
+            parts.append((offset, length))
+    transfer.done = transfer.initial
+    
+    def send_part(offset, length):
+        chunk = read_part(filepath, offset, length)
+        params = {
+            'action': 'upload_chunk',
+            'upload_id': upload_id,
+            'offset': offset,
+            'sha256': hashlib.sha256(chunk).hexdigest()
+        }
+        body, encoding = chunk, None
+        if compression == 'gzip' and length >= COMPRESSION_MIN_SIZE:
+            packed = gzip.compress(chunk, compresslevel=COMPRESSION_LEVEL)
+            if len(packed) < length:
+                body, encoding = packed, 'gzip'
+        data = api_post_bytes(params, body, content_encoding=encoding).json()
+        if data.get('status') != 'success':
+            return data.get('message', 'Upload failed')
+        transfer.advance(length)
+        return None
+    
+    transfer.draw()
+    error = run_parts(transfer, parts, send_part)
+    if not transfer.quiet:
+        print()
+    
+    if error:
+        transfer_error(transfer, f"Upload interrupted: {error}")
+        transfer_note(transfer, f"{GRAY}Share the same file again to resume{RESET}")
+        return False
+    
+    try:
+        data = api_post({'action': 'upload_complete', 'upload_id': upload_id}, timeout=30).json()
+    except Exception as e:
+        transfer_error(transfer, f"Upload error: {str(e)}")
+        transfer_note(transfer, f"{GRAY}Share the same file again to resume{RESET}")
+        return False
+    
+    if data.get('status') != 'success':
+        return transfer_error(transfer, data.get('message', 'Upload failed'))
+    
+    with _upload_state_lock:
+        state = load_json_file(UPLOAD_STATE_FILE)
+        state.pop(resume_key, None)
+        save_json_file(UPLOAD_STATE_FILE, state)
+    
+    transfer.file_code = data.get('file_code')
+    transfer_note(transfer, f"{GREEN}✓ File shared successfully! Code: {data.get('file_code')}{RESET}")
+    return True
+
+def upload_file_linked(meta, transfer):
+    """Share content the server already holds, by SHA-256, without sending it
+
+    Returns None when the server doesn't have the content (or doesn't
+    support linking), otherwise True.
+    """
+    try:
+        response = api_post(dict(meta, action='link_file'))
+        data = response.json() if response.status_code == 200 else {}
+    except (ValueError, requests.exceptions.RequestException):
+        return None
+    
+    if not isinstance(data, dict) or data.get('status') != 'success' or not data.get('file_code'):
+        return None
+    
+    transfer.initial = transfer.done = transfer.total
+    transfer.file_code = data.get('file_code')
+    transfer_note(transfer, f"{GREEN}✓ File shared successfully! Code: {data.get('file_code')} {GRAY}(already on server, nothing uploaded){RESET}")
+    return True
+
+def upload_file_single(filepath, meta, transfer):
+    """One-request upload for servers without chunked support, streamed from disk"""
+    def on_progress(nbytes):
+        transfer.checkpoint()
+        transfer.advance(nbytes)
+        transfer.draw()
+    
+    body = Base64JSONBody(dict(meta, action='upload_file'), filepath, meta['filesize'], on_progress=on_progress)
+    
+    try:
+        response = api_post_bytes(None, body, timeout=30, content_type='application/json')  # Longer timeout for files
+        transfer_note(transfer, "")
+        
+        if response.status_code == 200:
+            data = response.json()
+            if data.get('status') == 'success':
+                transfer.file_code = data.get('file_code')
+                transfer_note(transfer, f"{GREEN}✓ File shared successfully! Code: {data.get('file_code')}{RESET}")
+                return True
+            else:
+                return transfer_error(transfer, data.get('message', 'Upload failed'))
+        else:
+            return transfer_error(transfer, f"Server error: {response.status_code}")
+    except requests.exceptions.Timeout:
+        transfer_note(transfer, "")
+        return transfer_error(transfer, "Upload timeout")
+    except Exception as e:
+        # Cancelling from inside the body generator surfaces as a send error
+        if transfer.status == "cancelled":
+            raise TransferCancelled()
+        transfer_note(transfer, "")
+        return transfer_error(transfer, f"Upload error: {str(e)}")
+
+def upload_file(sender, filepath, expire="24h", room_id=None, private_to=None, transfer=None):
+    """Upload and share a file (transfer: an existing Transfer to report progress on)"""
+    
+    if not os.path.exists(filepath):
+        return transfer_error(transfer, f"File not found: {filepath}")
+    
+    # Check file size (max 100MB)
+    file_size = os.path.getsize(filepath)
+    if file_size > 100 * 1024 * 1024:
+        return transfer_error(transfer, "File too large. Max 100MB")
+    
+    if not os.access(filepath, os.R_OK):
+        return transfer_error(transfer, "Error reading file: permission denied")
+    
+    filename = os.path.basename(filepath)
+    
+    if transfer is None or not transfer.quiet:
+        print(f"{YELLOW}⬆️ Uploading {filename}...{RESET}")
+    
+    meta = {
+        'sender': sender,
+        'filename': filename,
+        'filesize': file_size,
+        'expire': expire
+    }
+    
+    if room_id and room_id != "lobby":
+        meta['room_id'] = room_id
+    
+    if private_to:
+        meta['private_to'] = private_to
+    
+    if transfer is None:
+        transfer = Transfer("upload", filename)
+    transfer.name = filename
+    transfer.total = file_size
+    
+    # Same bytes shared before (another room, a re-post): just link them
+    meta['sha256'] = file_sha256(filepath)
+    transfer.checkpoint()
+    result = upload_file_linked(meta, transfer)
+    if result is None:
+        result = upload_file_chunked(filepath, meta, transfer)
+    if result is None:
+        result = upload_file_single(filepath, meta, transfer)
+    return transfer.finish(result)
+
+# ============================================
+# DOWNLOADS
+# ============================================
+
+class Base64FieldReader:
+    """Pulls one base64 string field out of a JSON body as it streams in
+
+    The decoded field is written to `out` chunk by chunk; everything around
+    it is kept (it's small) and parsed by metadata() once the body is done.
+    """
+    
+    def __init__(self, field, out):
+        self.pattern = re.compile(rb'"' + field.encode('utf-8') + rb'"\s*:\s*"')
+        self.out = out
+        self.state = 'head'
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.pending = b''
+        self.decoded = 0
+    
+    def feed(self, chunk):
+        if self.state == 'head':
+            self.head += chunk
+            match = self.pattern.search(self.head)
+            if not match:
+                return
+            chunk = bytes(self.head[match.end():])
+            del self.head[match.end():]
+            self.state = 'data'
+        
+        if self.state == 'data':
+            end = chunk.find(b'"')
+            # Base64 never contains a backslash: drop JSON escapes like \/
+            self._decode((chunk if end < 0 else chunk[:end]).replace(b'\\', b''))
+            if end < 0:
+                return
+            self._decode(b'', final=True)
+            self.state = 'tail'
+            chunk = chunk[end + 1:]
+        
+        self.tail += chunk
+    
+    def _decode(self, data, final=False):
+        data = self.pending + data
+        usable = len(data) if final else len(data) - len(data) % 4
+        self.pending = data[usable:]
+        if usable:
+            decoded = base64.b64decode(data[:usable])
+            self.out.write(decoded)
+            self.decoded += len(decoded)
+    
+    def peek(self, key):
+        """Look up a numeric field that appeared before the data, if any"""
+        match = re.search(rb'"' + key.encode('utf-8') + rb'"\s*:\s*(\d+)', self.head)
+        return int(match.group(1)) if match else None
+    
+    def metadata(self):
+        if self.state == 'head':
+            return json.loads(bytes(self.head))
+        return json.loads(bytes(self.head) + b'"' + bytes(self.tail))
+
+def unique_save_path(filename):
+    """Path in the current directory that doesn't overwrite an existing file"""
+    filename = os.path.basename(filename) or "download"
+    save_path = os.path.join(os.getcwd(), filename)
+    
+    # If file exists, add number
+    counter = 1
+    original_filename = filename
+    while os.path.exists(save_path):
+        name, ext = os.path.splitext(original_filename)
+        filename = f"{name}_{counter}{ext}"
+        save_path = os.path.join(os.getcwd(), filename)
+        counter += 1
+    
+    return save_path
+
+def finish_download(part_path, filename, transfer, expected_sha256=None):
+    """Verify the whole-file checksum and move the .part file into place"""
+    if expected_sha256 and file_sha256(part_path) != expected_sha256:
+        os.remove(part_path)
+        return transfer_error(transfer, "Download corrupted (checksum mismatch), please try again")
+    
+    save_path = unique_save_path(filename)
+    os.replace(part_path, save_path)
+    transfer.saved_to = save_path
+    transfer_note(transfer, f"{GREEN}✓ Downloaded to: {save_path}{RESET}")
+    return True
+
+def download_file_parts(file_code, username, filename, total, expected_sha256, transfer):
+    """Fetch DOWNLOAD_PART_SIZE ranges concurrently into a preallocated .part file
+
+    Finished parts are recorded next to it so an interrupted download only
+    refetches what's missing. Parts are checked against X-Content-SHA256.
+    """
+    part_path = os.path.join(os.getcwd(), f".{file_code}.part")
+    state_path = part_path + ".json"
+    
+    state = load_json_file(state_path)
+    if state.get('total') != total or state.get('part_size') != DOWNLOAD_PART_SIZE or not os.path.exists(part_path):
+        state = {'total': total, 'part_size': DOWNLOAD_PART_SIZE, 'done': []}
+        with open(part_path, 'wb') as f:
+            f.truncate(total)
+    elif state['done']:
+        transfer_note(transfer, f"{GRAY}Resuming download ({len(state['done'])} parts already here){RESET}")
+    
+    done_parts = set(state['done'])
+    state_lock = threading.Lock()
+    
+    parts = []
+    for offset in range(0, total, DOWNLOAD_PART_SIZE):
+        length = min(DOWNLOAD_PART_SIZE, total - offset)
+        if offset in done_parts:
+            transfer.initial += length
+        else:
+            parts.append((offset, length))
+    transfer.done = transfer.initial
+    
+    params = {'action': 'download_raw', 'file_code': file_code, 'username': username}
+    # Byte ranges are of the original file, the server gzips each part on the wire
+    encoding = 'gzip' if is_compressible(filename) else 'identity'
+    
+    def fetch_part(offset, length):
+        headers = {'Range': f'bytes={offset}-{offset + length - 1}', 'Accept-Encoding': encoding}
+        written = 0
+        digest = hashlib.sha256()
+        
+        try:
+            with api_get(params, timeout=10, stream=True, headers=headers) as response:
+                if response.status_code != 206:
+                    return f"Server error: {response.status_code}"
+                with open(part_path, 'r+b') as f:
+                    f.seek(offset)
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        transfer.checkpoint()
+                        f.write(chunk)
+                        digest.update(chunk)
+                        written += len(chunk)
+                        transfer.advance(len(chunk))
+                
+                expected = response.headers.get('X-Content-SHA256')
+                if written != length or (expected and digest.hexdigest() != expected):
+                    transfer.advance(-written)
+                    return "Part checksum mismatch"
+        except Exception:
+            transfer.advance(-written)
+            raise
+        
+        with state_lock:
+            state['done'].append(offset)
+            save_json_file(state_path, state)
+        return None
+    
+    transfer.draw()
+    try:
+        error = run_parts(transfer, parts, fetch_part)
+    except TransferCancelled:
+        for path in (part_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    
+    if not transfer.quiet:
+        print()
+    
+    if error:
+        transfer_error(transfer, f"Download interrupted: {error}")
+        transfer_note(transfer, f"{GRAY}Run /get {file_code} again to resume{RESET}")
+        return False
+    
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return finish_download(part_path, filename, transfer, expected_sha256)
+
+def download_file_raw(file_code, username, transfer):
+    """Raw-bytes download: parallel ranges when the server supports Range
+
+    Returns None when the server has no download_raw action.
+    """
+    params = {'action': 'download_raw', 'file_code': file_code, 'username': username}
+    response = api_get(params, timeout=10, stream=True, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'})
+    
+    disposition = response.headers.get('Content-Disposition', '')
+    if response.status_code not in (200, 206) or 'attachment' not in disposition:
+        response.close()
+        return None
+    
+    match = re.search(r'filename="?([^";]+)"?', disposition)
+    filename = match.group(1) if match else f"file_{file_code}"
+    expected_sha256 = response.headers.get('X-File-SHA256')
+    transfer.name = filename
+    
+    if response.status_code == 206:
+        response.close()
+        transfer.total = int(response.headers.get('Content-Range', '/0').rsplit('/', 1)[1])
+        if not transfer.quiet:
+            print(f"{YELLOW}⬇️ Downloading {filename} ({format_file_size(transfer.total)})...{RESET}")
+        return download_file_parts(file_code, username, filename, transfer.total, expected_sha256, transfer)
+    
+    # No Range support: the probe response is the whole file
+    part_path = os.path.join(os.getcwd(), f".{file_code}.part")
+    transfer.total = int(response.headers.get('X-File-Size') or response.headers.get('Content-Length') or 0)
+    if not transfer.quiet:
+        print(f"{YELLOW}⬇️ Downloading {filename} ({format_file_size(transfer.total)})...{RESET}")
+    
+    with response:
+        try:
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    transfer.checkpoint()
+                    f.write(chunk)
+                    transfer.advance(len(chunk))
+                    if transfer.total:
+                        transfer.draw()
+        except (requests.exceptions.RequestException, OSError, TransferCancelled) as e:
+            os.remove(part_path)
+            if isinstance(e, TransferCancelled):
+                raise
+            transfer_note(transfer, "")
+            return transfer_error(transfer, f"Download interrupted: {str(e)}")
+    
+    if not transfer.quiet:
+        print()
+    return finish_download(part_path, filename, transfer, expected_sha256)
+
+def download_file_json(file_code, username, transfer):
+    """Legacy JSON download, base64 decoded to disk while the body streams in"""
+    part_path = os.path.join(os.getcwd(), f".{file_code}.part")
+    
+    response = api_get({'action': 'download_file', 'file_code': file_code, 'username': username}, timeout=10, stream=True)
+    
+    if response.status_code != 200:
+        response.close()
+        return transfer_error(transfer, f"Server error: {response.status_code}")
+    
+    estimated_size = int(response.headers.get('Content-Length') or 0) * 3 // 4
+    drawn = False
+    
+    try:
+        with response, open(part_path, 'wb') as f:
+            reader = Base64FieldReader('filedata', f)
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                transfer.checkpoint()
+                reader.feed(chunk)
+                transfer.total = reader.peek('filesize') or estimated_size
+                transfer.done = reader.decoded
+                if reader.state != 'head' and transfer.total:
+                    transfer.draw()
+                    drawn = True
+        data = reader.metadata()
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    
+    if drawn and not transfer.quiet:
+        print()
+    
+    if not isinstance(data, dict) or data.get('status') == 'error' or reader.state == 'head':
+        os.remove(part_path)
+        message = data.get('message', 'Download failed') if isinstance(data, dict) else 'Download failed'
+        return transfer_error(transfer, message)
+    
+    transfer.name = data.get('filename', f"file_{file_code}")
+    return finish_download(part_path, transfer.name, transfer)
+
+def download_file(file_code, username, transfer=None):
+    """Download a file by code (transfer: an existing Transfer to report progress on)"""
+    
+    if transfer is None:
+        transfer = Transfer("download", file_code)
+    
+    if not transfer.quiet:
+        print(f"{YELLOW}⬇️ Fetching file info...{RESET}")
+    
+    try:
+        result = download_file_raw(file_code, username, transfer)
+        if result is None:
+            result = download_file_json(file_code, username, transfer)
+        return transfer.finish(result)
+    except TransferCancelled:
+        raise
+    except requests.exceptions.Timeout:
+        return transfer.finish(transfer_error(transfer, "Download timeout"))
+    except Exception as e:
+        return transfer.finish(transfer_error(transfer, f"Download error: {str(e)}"))
+
+def list_files(username):
+    """List all files user has access to"""
+    
+    try:
+        response = api_get({'action': 'list_files', 'username': username}, cache=True)
+        
+        if response.status_code == 200:
+            files = response.json()
+            
+            if not files:
+                print(f"{GRAY}No files found.{RESET}")
+                return
+            
+            print(f"\n{CYAN}════════════════════════════════════════════════════{RESET}")
+            print(f"{YELLOW}SHARED FILES{RESET}")
+            print(f"{CYAN}════════════════════════════════════════════════════{RESET}")
+            
+            current_time = time.time()
+            
+            for code, file in files.items():
+                # Format expiration
+                expires = file.get('expires')
+                expire_text = ""
+                if expires:
+                    hours_left = round((expires - current_time) / 3600, 1)
+                    if hours_left > 0:
+                        expire_text = f" {GRAY}(expires in {hours_left}h){RESET}"
                     else:
                         expire_text = f" {RED}(expired){RESET}"
                 
@@ -506,7 +2560,7 @@ def list_files(username):
                 size_text = format_file_size(file.get('size', 0))
                 
                 # Format time
-                uploaded = time.strftime('%H:%M %m/%d', time.localtime(file.get('uploaded_at', 0)))
+                uploaded = format_clock(file.get('uploaded_at', 0), '%H:%M %m/%d')
                 
                 # Who shared
                 sender = file.get('sender', 'Unknown')
@@ -545,8 +2599,7 @@ def unshare_file(file_code, username):
     }
     
     try:
-        headers = {'Content-Type': 'application/json'}
-        response = requests.post(SERVER_URL, json=payload, headers=headers, timeout=5)
+        response = api_post(payload)
         
         if response.status_code == 200:
             data = response.json()
@@ -582,6 +2635,7 @@ def show_help():
     print(f"{GREEN}/public{RESET}         - Switch to public chat")
     print(f"{GREEN}/private{RESET}        - Switch to private messages")
     print(f"{GREEN}!exit{RESET}           - Exit the chat application")
+    print(f"{GREEN}/scroll [up|down|end]{RESET} - Page through older messages (or PageUp/PageDown)")
     print()
     
     # ROOM COMMANDS
@@ -612,6 +2666,9 @@ def show_help():
     print(f"{GREEN}/files{RESET}          - List all files you can access")
     print(f"{GREEN}/unshare [CODE]{RESET} - Delete/stop sharing your file")
     print(f"{GRAY}Example:{RESET} /unshare ABC123")
+    print(f"{GREEN}/transfers{RESET}      - Live progress of uploads and downloads")
+    print(f"{GREEN}/pause [ID]{RESET}     - Pause a transfer ({GREEN}/resume [ID]{RESET} to continue)")
+    print(f"{GREEN}/cancel [ID]{RESET}    - Cancel a transfer")
     print(f"{GRAY}Note:{RESET} Max file size: 100MB | Expiry: 1h-24h (default: 24h)")
     print()
     
@@ -634,6 +2691,9 @@ def show_help():
     print(f"{GREEN}/get CODE              {GRAY}Download a file{RESET}")
     print(f"{GREEN}/files                 {GRAY}List shared files{RESET}")
     print(f"{GREEN}/unshare CODE          {GRAY}Delete shared file{RESET}")
+    print(f"{GREEN}/transfers             {GRAY}Show file transfers{RESET}")
+    print(f"{GREEN}/pause, /resume, /cancel ID {GRAY}Control a transfer{RESET}")
+    print(f"{GREEN}/scroll up|down|end    {GRAY}Page through history{RESET}")
     print(f"{GREEN}@user message          {GRAY}Send private message{RESET}")
     print(f"{GREEN}!exit                  {GRAY}Exit chat{RESET}")
     print(f"{GREEN}/help, /h, /?          {GRAY}Show this help{RESET}")
@@ -644,103 +2704,336 @@ def show_help():
     # Clear screen after pressing Enter
     sys.stdout.write("\033[2J\033[H")
 
+# ============================================
+# TERMINAL RENDERING
+# ============================================
+
+ANSI_ESCAPE = re.compile(r'\033\[[0-9;?]*[A-Za-z]')
+PROMPT = f"{YELLOW}You: {RESET}"
+
+def display_width(text):
+    """Terminal columns text takes (colour codes skipped, wide chars count 2)"""
+    width = 0
+    for char in ANSI_ESCAPE.sub('', text):
+        if unicodedata.combining(char) or char in '\u200d\ufe0f':
+            continue
+        width += 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+    return width
+
+class Screen:
+    """What the chat screen currently shows, so refreshes only write what changed
+
+    The screen is a list of lines (header + messages), a status line (blank
+    unless something is being reported) and the prompt with whatever the
+    user has typed so far. render() compares the new lines with the drawn
+    ones and repaints from the first difference down in one write; new
+    messages are just appended. The screen is cleared only when the
+    difference has scrolled off the top or something else printed to the
+    terminal in between.
+    """
+    
+    def __init__(self):
+        self.out = sys.stdout
+        self.lines = None  # None: the terminal content is unknown
+        self.status = ""
+        self.input = ""
+        self.drawn_status = ""
+        self.drawn_prompt = ""
+        self.prompt_shown = False
+        self.size = None
+        self.row_counts = {}
+        self.row_columns = None
+        self.lock = threading.RLock()
+    
+    def start(self):
+        """Take over the terminal: other writes to sys.stdout invalidate the model"""
+        self.out = sys.stdout
+        sys.stdout = ScreenOutput(self, self.out)
+    
+    def stop(self):
+        if isinstance(sys.stdout, ScreenOutput):
+            sys.stdout = self.out
+    
+    def invalidate(self):
+        self.lines = None
+        self.prompt_shown = False
+    
+    def write(self, text):
+        self.out.write(text)
+        self.out.flush()
+    
+    def rows(self, text):
+        columns = max(shutil.get_terminal_size().columns, 1)
+        if columns != self.row_columns or len(self.row_counts) > ROW_CACHE_SIZE:
+            # Resized: every line wraps differently
+            self.row_counts = {}
+            self.row_columns = columns
+        rows = self.row_counts.get(text)
+        if rows is None:
+            rows = sum(max(1, -(-display_width(line) // columns)) for line in text.split('\n'))
+            self.row_counts[text] = rows
+        return rows
+    
+    def render(self, lines):
+        with self.lock:
+            size = shutil.get_terminal_size()
+            prompt = PROMPT + self.input
+            
+            keep = 0
+            if self.lines is not None and size == self.size:
+                limit = min(len(self.lines), len(lines))
+                while keep < limit and self.lines[keep] == lines[keep]:
+                    keep += 1
+                if keep == len(self.lines) == len(lines) and self.status == self.drawn_status and prompt == self.drawn_prompt:
+                    return
+                up = sum(self.rows(line) for line in self.lines[keep:]) + self.rows(self.drawn_status) + self.rows(self.drawn_prompt) - 1
+            
+            if self.lines is None or size != self.size or up >= size.lines:
+                frame = "\033[2J\033[H"
+                # Only what fits: anything above would scroll straight off
+                room = size.lines - self.rows(self.status) - self.rows(prompt)
+                keep = len(lines)
+                while keep > 0 and self.rows(lines[keep - 1]) <= room:
+                    keep -= 1
+                    room -= self.rows(lines[keep])
+            else:
+                frame = "\r" + (f"\033[{up}A" if up else "") + "\033[J"
+            
+            frame += "".join(line + "\n" for line in lines[keep:]) + self.status + "\n" + prompt
+            self.write(frame)
+            
+            self.lines = list(lines)
+            self.size = size
+            self.drawn_status = self.status
+            self.drawn_prompt = prompt
+            self.prompt_shown = True
+    
+    def show_prompt(self):
+        """Put the prompt back under whatever was printed since the last render"""
+        with self.lock:
+            if not self.prompt_shown:
+                self.write("\n" + PROMPT + self.input)
+                self.prompt_shown = True
+    
+    def repaint_prompt(self):
+        with self.lock:
+            prompt = PROMPT + self.input
+            up = self.rows(self.drawn_prompt) - 1 if self.prompt_shown else 0
+            self.write("\r" + (f"\033[{up}A" if up else "") + "\033[J" + prompt)
+            self.drawn_prompt = prompt
+    
+    def type(self, text):
+        with self.lock:
+            self.input += text
+            self.drawn_prompt = PROMPT + self.input
+            self.write(text)
+    
+    def backspace(self):
+        with self.lock:
+            if self.input:
+                self.input = self.input[:-1]
+                self.repaint_prompt()
+    
+    def clear_input(self):
+        with self.lock:
+            self.input = ""
+            self.repaint_prompt()
+    
+    def take_input(self):
+        """Hand over the typed line (Enter); the status line is cleared with it"""
+        with self.lock:
+            line, self.input = self.input, ""
+            self.status = ""
+            return line
+    
+    def newline(self):
+        """Leave the typed line on screen, like a plain terminal would, for command output"""
+        with self.lock:
+            self.write("\n")
+            self.invalidate()
+
+def scroll_window(body, offset, header_size):
+    """Body lines on screen when scrolled `offset` lines back from the newest"""
+    if offset <= 0:
+        return body
+    
+    rows = max(shutil.get_terminal_size().lines - header_size - 3, 1)
+    end = max(len(body) - offset, min(rows, len(body)))
+    newer = len(body) - end
+    return body[max(end - rows, 0):end] + [f"{GRAY}── {newer} newer below | /scroll down | /scroll end ──{RESET}"]
+
+class ScreenOutput:
+    """sys.stdout stand-in that tells the Screen when something else printed"""
+    
+    def __init__(self, screen, stream):
+        self.screen = screen
+        self.stream = stream
+    
+    def write(self, text):
+        self.screen.invalidate()
+        return self.stream.write(text)
+    
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+screen = Screen()
+
+_saved_tty_mode = None
+
+def set_key_input(enabled):
+    """Switch a terminal stdin between per-key input (no echo) and line input
+
+    Returns False when stdin isn't a terminal, which stays line based.
+    """
+    global _saved_tty_mode
+    
+    if termios is None or not sys.stdin.isatty():
+        return False
+    
+    fd = sys.stdin.fileno()
+    if enabled:
+        if _saved_tty_mode is None:
+            _saved_tty_mode = termios.tcgetattr(fd)
+        tty.setcbreak(fd)
+    elif _saved_tty_mode is not None:
+        termios.tcsetattr(fd, termios.TCSADRAIN, _saved_tty_mode)
+    return True
+
 # ============================================
 # DISPLAY FUNCTIONS (UPDATED WITH HELP COMMAND)
 # ============================================
 
-def display_public_chat(username, messages, show_prompt=True):
+# Unread messages per view not on screen, and the views' display names
+unread_counts = {}
+view_names = {("public", None): "Public"}
+
+@functools.lru_cache(maxsize=4096)
+def clock_text(minute, fmt='%H:%M'):
+    return time.strftime(fmt, time.localtime(minute * 60))
+
+def format_clock(timestamp, fmt='%H:%M'):
+    """Local time of a timestamp, formatted once per minute shown"""
+    return clock_text(int((timestamp or 0) // 60), fmt)
+
+def format_message_line(message, style, username):
+    timestamp = format_clock(message.get('timestamp', 0))
+    if style == "private":
+        if message['sender'] == username:
+            return f"{GREEN}[{timestamp}] To {message['receiver']}: {RESET}{message['message']}{echo_suffix(message)}"
+        return f"{PURPLE}[{timestamp}] From {message['sender']}: {RESET}{message['message']}"
+    if message['sender'] == username:
+        return f"{GREEN}[{timestamp}] You: {RESET}{message['message']}{echo_suffix(message)}"
+    if style == "public" and message['sender'] == 'Administrator':
+        return f"{YELLOW}[{timestamp}] {message['sender']}: {RESET}{message['message']}"
+    color = CYAN if style == "room" else BLUE
+    return f"{color}[{timestamp}] {message['sender']}: {RESET}{message['message']}"
+
+def message_line(message, style, username):
+    """A message's screen line for a view style, formatted once per record and user
+
+    Echoes (plain dicts) change status while sending, so they're formatted every time.
+    """
+    if not isinstance(message, Message):
+        return format_message_line(message, style, username)
+    key = (style, username)
+    if message.line is None or message.line[0] != key:
+        message.line = (key, format_message_line(message, style, username))
+    return message.line[1]
+
+def echo_suffix(message):
+    """Marker for a local echo of an outgoing message: sending or not sent"""
+    if message.get('status') in ('pending', 'sent'):
+        return f" {GRAY}…{RESET}"
+    if message.get('status') == 'failed':
+        return f" {RED}✗ not sent{RESET}"
+    if message.get('status') == 'offline':
+        return f" {YELLOW}⏸ offline, will retry{RESET}"
+    return ""
+
+def unread_summary():
+    """Header line with the other views' unread counts, or nothing"""
+    if not unread_counts:
+        return []
+    counts = ", ".join(f"{view_names.get(view, view[1])} ({count})" for view, count in unread_counts.items())
+    return [f"{YELLOW}📬 Unread: {counts}{RESET}"]
+
+def display_public_chat(username, messages, offset=0):
     global current_room_name
     
-    # SMOOTH CLEAR - NO BLINK
-    sys.stdout.write("\033[2J\033[H")
-    
-    print(f"{BLUE}="*50 + RESET)
-    print(f"{YELLOW}PUBLIC CHAT - {current_room_name}{RESET}")
-    print(f"{GRAY}Type '/private' for Private Messages | '/create' to create room{RESET}")
-    print(f"{GRAY}Type '/share filename' to share file | '/files' to list files{RESET}")
-    print(f"{GRAY}Type '/list' to view your rooms | '/help' for all commands{RESET}")
-    print(f"{GRAY}Type '!exit' to exit{RESET}")
-    print(f"{BLUE}="*50 + RESET + "\n")
+    header = [
+        f"{BLUE}="*50 + RESET,
+        f"{YELLOW}PUBLIC CHAT - {current_room_name}{RESET}",
+        f"{GRAY}Type '/private' for Private Messages | '/create' to create room{RESET}",
+        f"{GRAY}Type '/share filename' to share file | '/files' to list files{RESET}",
+        f"{GRAY}Type '/list' to view your rooms | '/help' for all commands{RESET}",
+        f"{GRAY}Type '!exit' to exit{RESET}",
+        *unread_summary(),
+        f"{BLUE}="*50 + RESET,
+        ""
+    ]
     
+    body = []
     if not messages:
-        print(f"{GRAY}No public messages yet. Start the conversation!{RESET}")
+        body.append(f"{GRAY}No public messages yet. Start the conversation!{RESET}")
     else:
-        for message in messages:
-            timestamp = time.strftime('%H:%M', time.localtime(message.get('timestamp', 0)))
-            if message['sender'] == username:
-                print(f"{GREEN}[{timestamp}] You: {RESET}{message['message']}")
-            elif message['sender'] == 'Administrator':
-                print(f"{YELLOW}[{timestamp}] {message['sender']}: {RESET}{message['message']}")
-            else:
-                print(f"{BLUE}[{timestamp}] {message['sender']}: {RESET}{message['message']}")
+        body = [message_line(message, "public", username) for message in messages]
     
-    if show_prompt:
-        print(f"\n{YELLOW}You: {RESET}", end='', flush=True)
+    screen.render(header + scroll_window(body, offset, len(header)))
 
-def display_private_chat(username, private_messages, show_prompt=True):
-    # SMOOTH CLEAR - NO BLINK
-    sys.stdout.write("\033[2J\033[H")
-    
-    print(f"{PURPLE}="*50 + RESET)
-    print(f"{YELLOW}PRIVATE MESSAGES{RESET}")
-    print(f"{GRAY}Type '/public' for Public Chat | '/create' to create room{RESET}")
-    print(f"{GRAY}Type '/share @user filename' to send private file{RESET}")
-    print(f"{GRAY}Type '/list' to view your rooms | '/help' for all commands{RESET}")
-    print(f"{GRAY}Type '!exit' to exit{RESET}")
-    print(f"{PURPLE}="*50 + RESET + "\n")
+def display_private_chat(username, private_messages, offset=0):
+    header = [
+        f"{PURPLE}="*50 + RESET,
+        f"{YELLOW}PRIVATE MESSAGES{RESET}",
+        f"{GRAY}Type '/public' for Public Chat | '/create' to create room{RESET}",
+        f"{GRAY}Type '/share @user filename' to send private file{RESET}",
+        f"{GRAY}Type '/list' to view your rooms | '/help' for all commands{RESET}",
+        f"{GRAY}Type '!exit' to exit{RESET}",
+        *unread_summary(),
+        f"{PURPLE}="*50 + RESET,
+        ""
+    ]
     
+    body = []
     if not private_messages:
-        print(f"{GRAY}No private messages yet.{RESET}")
-        print(f"{GRAY}Use @username to send a private message{RESET}")
+        body.append(f"{GRAY}No private messages yet.{RESET}")
+        body.append(f"{GRAY}Use @username to send a private message{RESET}")
     else:
-        sorted_pms = sorted(private_messages, key=lambda x: x.get('timestamp', 0), reverse=True)
-        
-        for pm in sorted_pms[:20]:
-            timestamp = time.strftime('%H:%M', time.localtime(pm.get('timestamp', 0)))
-            
-            if pm['sender'] == username:
-                print(f"{GREEN}[{timestamp}] To {pm['receiver']}: {RESET}{pm['message']}")
-            else:
-                print(f"{PURPLE}[{timestamp}] From {pm['sender']}: {RESET}{pm['message']}")
+        sorted_pms = sorted(private_messages, key=lambda x: x.get('timestamp', 0))
+        body = [message_line(pm, "private", username) for pm in sorted_pms]
     
-    if show_prompt:
-        print(f"\n{YELLOW}You: {RESET}", end='', flush=True)
+    screen.render(header + scroll_window(body, offset, len(header)))
 
-def display_room_chat(username, room_messages, room_info, show_prompt=True):
+def display_room_chat(username, room_messages, room_info, offset=0):
     global current_room_id, current_room_name
     
-    # SMOOTH CLEAR - NO BLINK
-    sys.stdout.write("\033[2J\033[H")
-    
-    print(f"{CYAN}="*50 + RESET)
+    header = [f"{CYAN}="*50 + RESET]
     
     if room_info:
-        room_creation_time = time.strftime('%Y-%m-%d %H:%M', time.localtime(room_info.get('created_at', 0)))
-        print(f"{YELLOW}ROOM: {room_info.get('name', 'Unknown Room')}{RESET}")
-        print(f"{GRAY}ID: {current_room_id} | Created: {room_creation_time} by {room_info.get('creator', 'Unknown')}{RESET}")
-        print(f"{GRAY}Users in room: {len(room_info.get('users', []))}{RESET}")
+        room_creation_time = format_clock(room_info.get('created_at', 0), '%Y-%m-%d %H:%M')
+        header.append(f"{YELLOW}ROOM: {room_info.get('name', 'Unknown Room')}{RESET}")
+        header.append(f"{GRAY}ID: {current_room_id} | Created: {room_creation_time} by {room_info.get('creator', 'Unknown')}{RESET}")
+        header.append(f"{GRAY}Users in room: {len(room_info.get('users', []))}{RESET}")
     else:
-        print(f"{YELLOW}ROOM: {current_room_name}{RESET}")
-        print(f"{GRAY}ID: {current_room_id}{RESET}")
+        header.append(f"{YELLOW}ROOM: {current_room_name}{RESET}")
+        header.append(f"{GRAY}ID: {current_room_id}{RESET}")
     
-    print(f"{GRAY}Type '/leave' to leave room | '/public' for Public Chat{RESET}")
-    print(f"{GRAY}Type '/share filename' to share file in room{RESET}")
-    print(f"{GRAY}Type '/list' to view your rooms | '/help' for all commands{RESET}")
-    print(f"{GRAY}Type '!exit' to exit{RESET}")
-    print(f"{CYAN}="*50 + RESET + "\n")
+    header += [
+        f"{GRAY}Type '/leave' to leave room | '/public' for Public Chat{RESET}",
+        f"{GRAY}Type '/share filename' to share file in room{RESET}",
+        f"{GRAY}Type '/list' to view your rooms | '/help' for all commands{RESET}",
+        f"{GRAY}Type '!exit' to exit{RESET}",
+        *unread_summary(),
+        f"{CYAN}="*50 + RESET,
+        ""
+    ]
     
+    body = []
     if not room_messages:
-        print(f"{GRAY}No messages in this room yet. Start the conversation!{RESET}")
+        body.append(f"{GRAY}No messages in this room yet. Start the conversation!{RESET}")
     else:
-        for message in room_messages:
-            timestamp = time.strftime('%H:%M', time.localtime(message.get('timestamp', 0)))
-            if message['sender'] == username:
-                print(f"{GREEN}[{timestamp}] You: {RESET}{message['message']}")
-            else:
-                print(f"{CYAN}[{timestamp}] {message['sender']}: {RESET}{message['message']}")
+        body = [message_line(message, "room", username) for message in room_messages]
     
-    if show_prompt:
-        print(f"\n{YELLOW}You: {RESET}", end='', flush=True)
+    screen.render(header + scroll_window(body, offset, len(header)))
     
     return True
 
@@ -799,6 +3092,74 @@ def display_rooms_list(username):
         except KeyboardInterrupt:
             raise
 
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+def control_transfer(message):
+    """Apply /pause ID, /resume ID or /cancel ID, returns a status line"""
+    parts = message.split()
+    verb = parts[0].lower()
+    
+    if len(parts) < 2 or not parts[1].lstrip('#').isdigit():
+        return f"{RED}✗ Usage: {verb} ID (see /transfers){RESET}"
+    
+    transfer = active_transfers.get(int(parts[1].lstrip('#')))
+    if not transfer:
+        return f"{RED}✗ No transfer #{parts[1].lstrip('#')}{RESET}"
+    
+    action, past = {'/pause': ('pause', 'paused'), '/resume': ('resume', 'resumed'), '/cancel': ('cancel', 'cancelled')}[verb]
+    if getattr(transfer, action)():
+        return f"{GREEN}✓ Transfer #{transfer.id} {past}{RESET}"
+    return f"{RED}✗ Transfer #{transfer.id} is {transfer.status}{RESET}"
+
+def show_transfers():
+    """Live list of transfers, redrawn every second until Enter
+
+    /pause, /resume and /cancel can be typed here directly.
+    """
+    status_colors = {"running": GREEN, "queued": YELLOW, "paused": YELLOW, "done": GRAY, "failed": RED, "cancelled": RED}
+    status_line = ""
+    
+    while True:
+        sys.stdout.write("\033[2J\033[H")
+        
+        print(f"{YELLOW}="*50 + RESET)
+        print(f"{YELLOW}FILE TRANSFERS{RESET}")
+        print(f"{GRAY}/pause ID | /resume ID | /cancel ID | Enter to go back{RESET}")
+        print(f"{YELLOW}="*50 + RESET + "\n")
+        
+        if not active_transfers:
+            print(f"{GRAY}No transfers yet. Use /share or /get to start one.{RESET}")
+        
+        for transfer in list(active_transfers.values()):
+            arrow = "⬆️" if transfer.kind == "upload" else "⬇️"
+            color = status_colors.get(transfer.status, GRAY)
+            percent = int(100 * transfer.done / transfer.total) if transfer.total else 0
+            
+            print(f"{GREEN}[#{transfer.id}]{RESET} {arrow} {transfer.name} {color}{transfer.status}{RESET}")
+            print(f"  {GRAY}├─ {format_file_size(transfer.done)}/{format_file_size(transfer.total)} ({percent}%){RESET}")
+            
+            if transfer.status == "running":
+                eta = transfer.eta()
+                eta_text = format_duration(eta) if eta is not None else "--:--"
+                print(f"  {GRAY}└─ {format_file_size(int(transfer.speed()))}/s | ETA {eta_text}{RESET}")
+            else:
+                print(f"  {GRAY}└─ {format_duration(transfer.active_time())} active{RESET}")
+        
+        if status_line:
+            print(f"\n{status_line}")
+        print(f"\n{YELLOW}> {RESET}", end='', flush=True)
+        
+        if select.select([sys.stdin], [], [], 1)[0]:
+            line = sys.stdin.readline().strip()
+            if check_command(line) != 'control_transfer':
+                return
+            status_line = control_transfer(line)
+
 def check_command(message):
     message_lower = message.lower().strip()
     
@@ -822,25 +3183,71 @@ def check_command(message):
         return 'list_files'
     elif message_lower.startswith('/unshare'):
         return 'unshare_file'
+    elif message_lower == '/transfers':
+        return 'show_transfers'
+    elif message_lower.split(' ')[0] == '/scroll':
+        return 'scroll'
+    elif message_lower.split(' ')[0] in ['/pause', '/resume', '/cancel']:
+        return 'control_transfer'
     elif message_lower in ['/help', '/h', '/?']:  # ADDED: Help command with shortcuts
         return 'show_help'
     else:
         return 'normal_message'
 
-def get_input_with_timeout(timeout=0.1):
-    try:
-        if sys.stdin in select.select([sys.stdin], [], [], timeout)[0]:
-            message = sys.stdin.readline().rstrip()
-            return message
-    except:
-        pass
-    return None
+# ============================================
+# ASYNC CHAT LOOP
+# ============================================
+
+_blocking_pool = DaemonPool(BLOCKING_WORKERS)
+
+async def run_blocking(func, *args, **kwargs):
+    """Await a blocking call (server request, prompt) without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_pool, functools.partial(func, *args, **kwargs))
+
+async def watch_room_deleted(post):
+    """Check the current room for admin deletion every refresh_interval"""
+    while not exit_flag:
+        await asyncio.sleep(refresh_interval)
+        if current_mode != "room":
+            continue
+        room_id = current_room_id
+        is_deleted, _ = await run_blocking(check_room_deleted, room_id)
+        if is_deleted:
+            post('room_deleted', room_id)
+
+def read_file_share_args(message):
+    """Parse '/share [@user] filename [--expire 2h]', returns (filename, expire, private_to)"""
+    parts = message.split(' ')
+    expire = "24h"
+    filename = ""
+
+    i = 1
+    while i < len(parts):
+        if parts[i] == '--expire' and i + 1 < len(parts):
+            expire = parts[i + 1]
+            i += 2
+        else:
+            if filename:
+                filename += " " + parts[i]
+            else:
+                filename = parts[i]
+            i += 1
+
+    # Handle @user for private file share
+    private_to = None
+    if filename.startswith('@') and ' ' in filename:
+        # Format: @username filename
+        parts2 = filename.split(' ', 1)
+        private_to = parts2[0][1:]  # Remove @
+        filename = parts2[1]
+
+    return filename, expire, private_to
 
 def start_chat(username):
-    global exit_flag, current_mode, current_room_id, current_room_name, last_display_time
-    
     try:
-        test_response = requests.get(SERVER_URL + '?action=messages', timeout=5)
+        # Cursor at now: cursor-aware servers answer without the history
+        test_response = api_get({'action': 'messages', 'since': time.time()})
         if test_response.status_code == 200:
             data = test_response.json()
             if isinstance(data, dict) and data.get('status') == 'error' and 'maintenance' in data.get('message', '').lower():
@@ -850,507 +3257,767 @@ def start_chat(username):
                 return
     except:
         pass
-    
-    last_message_count = 0
-    last_pm_count = 0
-    last_room_message_count = 0
-    messages = []
-    private_messages = []
-    room_messages = []
-    room_info = None
-    
+
     signal.signal(signal.SIGINT, signal_handler)
-    
-    if current_mode == "public":
-        messages = get_messages()
-        display_public_chat(username, messages, show_prompt=True)
-        last_message_count = len(messages)
-    elif current_mode == "private":
-        private_messages = get_private_messages(username)
-        display_private_chat(username, private_messages, show_prompt=True)
-        last_pm_count = len(private_messages)
-    else:
-        room_messages = get_room_messages(current_room_id)
-        success, info = get_room_info(current_room_id)
-        if success:
-            room_info = info
-            current_room_name = info.get('name', 'Unknown Room')
-        display_room_chat(username, room_messages, room_info, show_prompt=True)
-        last_room_message_count = len(room_messages)
-    
-    last_display_time = time.time()
-    
+
+    screen.start()
     try:
-        while not exit_flag:
-            current_time = time.time()
-            
-            should_refresh = (current_time - last_display_time) >= refresh_interval
-            
-            if should_refresh:
-                if current_mode == "public":
-                    new_messages = get_messages()
-                    current_count = len(new_messages)
-                    
-                    if current_count != last_message_count:
-                        display_public_chat(username, new_messages, show_prompt=True)
-                        messages = new_messages
-                        last_message_count = current_count
-                        last_display_time = current_time
-                        
-                elif current_mode == "private":
-                    new_private_messages = get_private_messages(username)
-                    current_pm_count = len(new_private_messages)
-                    
-                    if current_pm_count != last_pm_count:
-                        display_private_chat(username, new_private_messages, show_prompt=True)
-                        private_messages = new_private_messages
-                        last_pm_count = current_pm_count
-                        last_display_time = current_time
-                        
+        asyncio.run(chat_loop(username))
+    except KeyboardInterrupt:
+        print(f"\n{YELLOW}Exiting... Goodbye!{RESET}")
+    except Exception as e:
+        print(f"\n{RED}Error: {e}{RESET}")
+    finally:
+        set_key_input(False)
+        screen.stop()
+        print(RESET)
+
+async def chat_loop(username):
+    """Event loop of the chat screen
+
+    Keyboard input, received messages, room-deletion checks and finished
+    background transfers all arrive as events on one queue and are handled
+    here in order, so the network never blocks typing and vice versa.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    background_tasks = set()
+
+    def post(*event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def spawn(coro):
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    def on_stdin():
+        line = sys.stdin.readline()
+        if not line:
+            loop.remove_reader(sys.stdin)
+            events.put_nowait(('eof',))
+        else:
+            events.put_nowait(('input', line.rstrip('\n')))
+
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    escape = ""
+    scroll_keys = {"\033[5~": "up", "\033[6~": "down"}
+
+    def on_keys():
+        """Per-key input on a terminal: the prompt keeps what's typed across redraws"""
+        nonlocal escape
+
+        data = os.read(sys.stdin.fileno(), 1024)
+        if not data:
+            loop.remove_reader(sys.stdin)
+            events.put_nowait(('eof',))
+            return
+
+        typed = ""
+        for char in decoder.decode(data):
+            if escape:
+                # Arrow keys and friends: swallowed until the final byte
+                escape += char
+                if len(escape) > 2 and char.isalpha() or char == '~' or escape == "\033\033":
+                    if escape in scroll_keys:
+                        events.put_nowait(('scroll', scroll_keys[escape]))
+                    escape = ""
+                continue
+            if char == '\033':
+                escape = char
+            elif char == '\n' or char == '\r':
+                screen.type(typed)
+                typed = ""
+                events.put_nowait(('input', screen.take_input()))
+            elif char in ('\x7f', '\b'):
+                screen.type(typed)
+                typed = ""
+                screen.backspace()
+            elif char == '\x15':
+                typed = ""
+                screen.clear_input()
+            elif char == '\x04' and not screen.input and not typed:
+                loop.remove_reader(sys.stdin)
+                events.put_nowait(('eof',))
+                return
+            elif char.isprintable():
+                typed += char
+        screen.type(typed)
+        poll_scheduler.wake()
+
+    key_input = set_key_input(True)
+    read_input = on_keys if key_input else on_stdin
+
+    async def modal(func, *args):
+        """Run an interactive screen that reads stdin itself (input())"""
+        loop.remove_reader(sys.stdin)
+        set_key_input(False)
+        try:
+            return await run_blocking(func, *args)
+        finally:
+            set_key_input(key_input)
+            screen.invalidate()
+            loop.add_reader(sys.stdin, read_input)
+
+    def prompt_line():
+        return input()
+
+    room_info = None
+    receiver = None
+    scroll_offset = 0
+    history_limit = SCROLLBACK_LINES
+    history_complete = False
+    displayed_view = None
+    watch_cursors = {}
+    # Views whose watch cursor carries on from their disk cache: only there
+    # the watcher's fetches extend the cached history without a gap
+    watch_cached = set()
+    rooms_checked = 0
+
+    def view_messages():
+        return message_store.get(current_view(username))
+
+    def set_view_messages(new_messages):
+        message_store.set(current_view(username), new_messages)
+
+    def prune_store():
+        """Keep messages only for the view on screen and the ones view_cache remembers"""
+        message_store.keep({current_view(username), *view_cache.entries})
+
+    def redraw():
+        global last_display_time
+        nonlocal displayed_view
+
+        # Whatever is on screen counts as read
+        view = current_view(username)
+        unread_counts.pop(view, None)
+        seen = latest_timestamp(view_messages())
+        if seen:
+            watch_cursors[view] = max(seen, watch_cursors.get(view, 0))
+            watch_cached.add(view)
+
+        # Outgoing messages show up right away, until fetched back
+        send_queue.settle(view, view_messages())
+        echoes = send_queue.echoes(view)
+
+        if current_mode == "public":
+            display_public_chat(username, view_messages() + echoes, scroll_offset)
+        elif current_mode == "private":
+            display_private_chat(username, view_messages() + echoes, scroll_offset)
+        else:
+            display_room_chat(username, view_messages() + echoes, room_info, scroll_offset)
+        last_display_time = time.time()
+        displayed_view = view
+
+    def merge_view(fetched, since):
+        """Merge fetched messages into the current view and the disk cache"""
+        view = current_view(username)
+        held = view_messages()
+        merged, changed = merge_messages(held, fetched, since, history_limit)
+        set_view_messages(merged)
+        if changed:
+            cache_messages_later(view, merged, replace=is_full_history(fetched, since, held), new=new_records(merged, held))
+        return changed
+
+    async def reload_view(delta=False):
+        """Show the current view: from the disk cache when possible, else fetched
+
+        delta=True only fetches what's newer than the messages on screen.
+        """
+        nonlocal scroll_offset, history_limit, history_complete
+
+        view = current_view(username)
+
+        if not delta:
+            # A fresh view starts at the newest messages
+            scroll_offset = 0
+            history_limit = SCROLLBACK_LINES
+            history_complete = False
+
+            cached = load_cached_messages(view, history_limit)
+            if cached:
+                # Instant: the receiver for this view fetches what came after
+                set_view_messages(cached)
+                redraw()
+                return
+
+        since = latest_timestamp(view_messages()) if delta else None
+        # A full fetch only needs what the scrollback keeps
+        limit = None if delta else history_limit
+        merge_view(await run_blocking(fetch_view_messages, view, since=since, limit=limit, report_errors=True), since)
+        redraw()
+
+    async def scroll(direction):
+        """Move through the history by half a screen, pulling older pages as needed"""
+        nonlocal scroll_offset, history_limit, history_complete
+
+        page = max(shutil.get_terminal_size().lines // 2, 5)
+        history = view_messages()
+
+        if direction == "end":
+            offset = 0
+        elif direction == "down":
+            offset = max(scroll_offset - page, 0)
+        else:
+            offset = scroll_offset + page
+            if offset + page > len(history) and history and not history_complete:
+                view = current_view(username)
+                oldest = history[0].get('timestamp', 0)
+                older = load_cached_messages(view, HISTORY_PAGE, before=oldest)
+                if not older:
+                    older = await run_blocking(fetch_view_history, view, oldest)
+                    cache_messages_later(view, older)
+                if older:
+                    history = older + history
+                    set_view_messages(history)
                 else:
-                    is_deleted, _ = check_room_deleted(current_room_id)
-                    if is_deleted:
-                        print(f"\n{RED}Room {current_room_id} has been deleted by admin!{RESET}")
-                        print(f"{GRAY}Returning to public chat...{RESET}")
-                        time.sleep(2)
-                        
-                        current_mode = "public"
-                        current_room_id = "lobby"
-                        current_room_name = "Public Chat"
-                        
-                        messages = get_messages()
-                        display_public_chat(username, messages, show_prompt=True)
-                        last_message_count = len(messages)
-                        last_display_time = time.time()
+                    history_complete = True
+            offset = min(offset, max(len(history) - page, 0))
+
+        # Scrolled back, nothing is dropped from the view; back at the
+        # bottom it shrinks to the regular scrollback again
+        if offset:
+            history_limit = None
+        else:
+            history_limit = SCROLLBACK_LINES
+            set_view_messages(history[-history_limit:])
+        scroll_offset = offset
+        redraw()
+
+    async def show_view(mode, room_id="lobby", room_name="Public Chat", info=None):
+        """Switch the screen to another view, straight from memory if it was open recently"""
+        global current_mode, current_room_id, current_room_name
+        nonlocal room_info, scroll_offset, history_limit, history_complete
+
+        if displayed_view == current_view(username):
+            set_view_messages(view_messages()[-SCROLLBACK_LINES:])
+            view_cache.put(displayed_view, room_info if current_mode == "room" else None)
+        # Failures were reported on the status line, their echoes go with the view
+        send_queue.forget_failed()
+
+        current_mode = mode
+        current_room_id = room_id
+        current_room_name = room_name
+
+        entry = view_cache.get(current_view(username))
+        prune_store()
+        if entry is not None:
+            if mode == "room":
+                room_info = info or entry['room_info']
+                if room_info:
+                    current_room_name = room_info.get('name', room_name)
+            scroll_offset = 0
+            history_limit = SCROLLBACK_LINES
+            history_complete = False
+            redraw()
+            return
+
+        if mode == "room":
+            if info is None:
+                success, info = await run_blocking(get_room_info, room_id)
+                if not success:
+                    info = None
+            room_info = info
+            if info:
+                current_room_name = info.get('name', room_name)
+
+        await reload_view()
+
+    async def enter_room(room_id, room_name, info=None):
+        """Switch the screen to a room, fetching its info unless already known"""
+        await show_view("room", room_id, room_name, info)
+
+    async def back_to_public():
+        await show_view("public")
+
+    async def keep_views_warm():
+        """Bring recently used views up to date now and then, so going back needs no fetch"""
+        while True:
+            await asyncio.sleep(VIEW_REFRESH_INTERVAL)
+            for view, entry in view_cache.due(current_view(username)):
+                since = latest_timestamp(message_store.get(view))
+                fetched = await run_blocking(fetch_view_messages, view, since=since)
+                held = message_store.get(view)
+                merged, changed = merge_messages(held, fetched, since, SCROLLBACK_LINES)
+                if changed:
+                    cache_messages_later(view, merged, replace=is_full_history(fetched, since, held), new=new_records(merged, held))
+
+                info = None
+                if view[0] == "room":
+                    success, info = await run_blocking(get_room_info, view[1])
+                    if not success:
+                        # Deleted or no longer ours: fetch afresh if it's ever opened again
+                        view_cache.drop(view)
                         continue
-                    
-                    new_room_messages = get_room_messages(current_room_id)
-                    current_room_msg_count = len(new_room_messages)
-                    
-                    if current_room_msg_count != last_room_message_count:
-                        success, info = get_room_info(current_room_id)
-                        if success:
-                            room_info = info
-                            current_room_name = info.get('name', 'Unknown Room')
-                        display_room_chat(username, new_room_messages, room_info, show_prompt=True)
-                        room_messages = new_room_messages
-                        last_room_message_count = current_room_msg_count
-                        last_display_time = current_time
-            
-            message = get_input_with_timeout(0.1)
-            
-            if message is not None and message != "":
-                command = check_command(message)
-                
-                if command == 'switch_to_public':
-                    current_mode = "public"
-                    current_room_id = "lobby"
-                    current_room_name = "Public Chat"
-                    print(f"{GREEN}✓ Switched to PUBLIC CHAT{RESET}")
-                    time.sleep(0.5)
-                    messages = get_messages()
-                    display_public_chat(username, messages, show_prompt=True)
-                    last_message_count = len(messages)
-                    last_display_time = time.time()
-                    continue
-                    
-                elif command == 'switch_to_private':
-                    current_mode = "private"
-                    current_room_id = "lobby"
-                    current_room_name = "Public Chat"
-                    print(f"{GREEN}✓ Switched to PRIVATE MESSAGES{RESET}")
-                    time.sleep(0.5)
-                    private_messages = get_private_messages(username)
-                    display_private_chat(username, private_messages, show_prompt=True)
-                    last_pm_count = len(private_messages)
-                    last_display_time = time.time()
-                    continue
-                
-                elif command == 'list_rooms':
-                    has_rooms, room_selection = display_rooms_list(username)
-                    
-                    if has_rooms and room_selection:
-                        room_id, room_name = room_selection
-                        
-                        if current_mode == "room" and current_room_id == room_id:
-                            print(f"{GRAY}You're already in this room{RESET}")
-                            time.sleep(1)
-                            display_room_chat(username, room_messages, room_info, show_prompt=True)
-                        else:
-                            print(f"{GRAY}Joining {room_name}...{RESET}")
-                            success, join_data = join_room(room_id, username)
-                            
-                            if success:
-                                print(f"{GREEN}✓ Joined room successfully!{RESET}")
-                                time.sleep(1)
-                                
-                                current_mode = "room"
-                                current_room_id = room_id
-                                current_room_name = room_name
-                                
-                                success, info = get_room_info(room_id)
-                                if success:
-                                    room_info = info
-                                    current_room_name = info.get('name', room_name)
-                                else:
-                                    current_room_name = room_name
-                                
-                                room_messages = get_room_messages(room_id)
-                                display_room_chat(username, room_messages, room_info, show_prompt=True)
-                                last_room_message_count = len(room_messages)
-                                last_display_time = time.time()
-                            else:
-                                print(f"{RED}✗ Failed to join room: {join_data.get('message', 'Unknown error')}{RESET}")
-                                time.sleep(2)
-                                if current_mode == "public":
-                                    display_public_chat(username, messages, show_prompt=True)
-                                elif current_mode == "private":
-                                    display_private_chat(username, private_messages, show_prompt=True)
-                                else:
-                                    display_room_chat(username, room_messages, room_info, show_prompt=True)
-                    
-                    elif not has_rooms:
-                        if current_mode == "public":
-                            messages = get_messages()
-                            display_public_chat(username, messages, show_prompt=True)
-                            last_message_count = len(messages)
-                        elif current_mode == "private":
-                            private_messages = get_private_messages(username)
-                            display_private_chat(username, private_messages, show_prompt=True)
-                            last_pm_count = len(private_messages)
-                        else:
-                            room_messages = get_room_messages(current_room_id)
-                            display_room_chat(username, room_messages, room_info, show_prompt=True)
-                            last_room_message_count = len(room_messages)
-                        
-                        last_display_time = time.time()
-                    
+                if view in view_cache.entries:
+                    message_store.set(view, merged)
+                view_cache.update(view, info)
+            prune_store()
+
+    async def watch_other_views():
+        """Count new messages in the views not on screen (joined rooms, public, private)
+
+        Each round is one batched request for up to WATCH_MAX_VIEWS views,
+        taking turns when there are more.
+        """
+        nonlocal rooms_checked
+
+        joined = []
+        turn = 0
+        view_names[("private", username)] = "Private"
+        while True:
+            # While the server is failing, back off along with the receiver
+            await asyncio.sleep(max(WATCH_INTERVAL, poll_scheduler.next_delay() if poll_scheduler.errors else 0))
+
+            if time.time() - rooms_checked >= WATCH_ROOMS_INTERVAL:
+                rooms = [room for room in await run_blocking(get_user_rooms, username) if room.get('id')]
+                joined = [("room", room.get('id')) for room in rooms if room.get('id') not in _deleted_rooms]
+                view_names.update((("room", room.get('id')), room.get('name', room.get('id'))) for room in rooms)
+                for view in list(unread_counts):
+                    if view[0] == "room" and view not in joined:
+                        del unread_counts[view]
+                rooms_checked = time.time()
+
+            current = current_view(username)
+            views = [view for view in [("public", None), ("private", username)] + joined if view != current]
+            if not views:
+                continue
+            turn %= len(views)
+            views = (views[turn:] + views[:turn])[:WATCH_MAX_VIEWS]
+            turn += len(views)
+
+            for view in views:
+                if view not in watch_cursors:
+                    # First look: unread counts start from what's cached, else from now
+                    cached = latest_timestamp(load_cached_messages(view, 1))
+                    if cached:
+                        watch_cached.add(view)
+                    watch_cursors[view] = cached or time.time()
+            results = await run_blocking(api_batch, [message_params(view, watch_cursors[view]) for view in views])
+
+            changed = False
+            for view, fetched in zip(views, results):
+                if not isinstance(fetched, list) or not fetched or view == current_view(username):
                     continue
-                
-                elif command == 'create_room':
-                    print(f"\n{YELLOW}Enter room name: {RESET}", end='', flush=True)
-                    room_name = ""
-                    while not room_name.strip():
-                        room_name = input()
-                    
-                    print(f"{GRAY}Creating room '{room_name}'...{RESET}")
-                    success, room_id, msg = create_room(room_name, username)
-                    
-                    if success:
-                        print(f"{GREEN}✓ Room created! ID: {room_id}{RESET}")
-                        print(f"{GRAY}Share this ID with others: {room_id}{RESET}")
-                        
-                        time.sleep(2)
-                        
-                        current_mode = "room"
-                        current_room_id = room_id
-                        current_room_name = room_name
-                        
-                        join_success, join_data = join_room(room_id, username)
-                        if join_success:
-                            room_info = join_data.get('room')
-                            room_messages = get_room_messages(room_id)
-                            display_room_chat(username, room_messages, room_info, show_prompt=True)
-                            last_room_message_count = len(room_messages)
-                            last_display_time = time.time()
+                since = watch_cursors[view]
+                new = [message for message in fetched if message.get('timestamp', 0) > since and message.get('sender') != username]
+                if new:
+                    unread_counts[view] = unread_counts.get(view, 0) + len(new)
+                    changed = True
+                watch_cursors[view] = max(since, latest_timestamp(fetched))
+                if view in watch_cached:
+                    cache_messages_later(view, fetched)
+            if changed:
+                post('unread')
+
+    def sync_receiver():
+        """Keep the background receiver on the view being displayed"""
+        nonlocal receiver
+
+        view = current_view(username)
+        if receiver is not None and receiver.view == view:
+            return
+        if receiver:
+            receiver.stop()
+        receiver = MessageReceiver(view, latest_timestamp(view_messages()), lambda *batch: post('messages', *batch))
+        receiver.start()
+
+    def on_messages(view, fetched, since):
+        nonlocal scroll_offset
+
+        if view != current_view(username):
+            return
+
+        before = len(view_messages())
+        changed = merge_view(fetched, since)
+
+        if scroll_offset:
+            # Keep the same messages on screen while new ones arrive below
+            scroll_offset = max(scroll_offset + len(view_messages()) - before, 0)
+
+        if changed:
+            if current_mode == "room":
+                spawn(refresh_room_info(current_room_id))
+            redraw()
+        elif screen.status != screen.drawn_status:
+            # A fetch error came up or cleared
+            redraw()
+
+    async def refresh_room_info(room_id):
+        nonlocal room_info
+        global current_room_name
+
+        success, info = await run_blocking(get_room_info, room_id)
+        if success and current_mode == "room" and current_room_id == room_id:
+            room_info = info
+            current_room_name = info.get('name', 'Unknown Room')
+
+    async def on_sent(item):
+        """The send queue is done with a message (or still trying): show how it went"""
+        if item['status'] == 'sent':
+            # Private ones sent from another view only get a note
+            if item['view'][0] == "private" and current_mode != "private":
+                screen.status = f"{GREEN}✓ Private message sent{RESET}"
+            # Fetch the server's copy soon
+            poll_scheduler.wake()
+        elif item['detail'] == 'room_deleted':
+            if current_view(username) == item['view']:
+                screen.newline()
+                print(f"{RED}✗ Room has been deleted by admin{RESET}")
+                await asyncio.sleep(2)
+                await back_to_public()
+            view_cache.drop(item['view'])
+            prune_store()
+            return
+        elif item['status'] == 'offline':
+            screen.status = f"{YELLOW}⏸ Server unreachable: {send_queue.unsent()} message(s) kept in the outbox, retrying{RESET}"
+        else:
+            screen.status = f"{RED}✗ Failed to send message: {item['detail']}{RESET}"
+        redraw()
+
+    def queue_transfer(kind, name, func, *args):
+        """Hand an upload/download to the background transfer manager"""
+        transfer = transfer_manager.submit(Transfer(kind, name), func, *args,
+                                           on_done=lambda finished: post('transfer_done', finished.id))
+        arrow = "⬆️" if kind == "upload" else "⬇️"
+        screen.status = f"{YELLOW}{arrow} Transfer #{transfer.id} queued: {name} {GRAY}(/transfers to watch){RESET}"
+        redraw()
+        return transfer
+
+    # Transfer id -> outbox entry of the share it's uploading
+    outbox_shares = {}
+
+    def queue_share(entry):
+        transfer = queue_transfer("upload", os.path.basename(entry['filepath']), upload_file, username,
+                                  entry['filepath'], entry['expire'], entry['room_id'], entry['private_to'])
+        outbox_shares[transfer.id] = entry['id']
+
+    async def share_done(transfer):
+        """A share's upload ended: drop it from the outbox unless the server was unreachable"""
+        entry_id = outbox_shares.pop(transfer.id)
+        if transfer.status == "failed" and not await run_blocking(server_reachable):
+            screen.status = f"{YELLOW}⏸ Server unreachable: {transfer.name} kept in the outbox, retrying{RESET}"
+            return
+        outbox_remove(entry_id)
+
+    async def replay_shares():
+        """Shares left in the outbox (by this run or an earlier one) go out once the server answers"""
+        while True:
+            waiting = [entry for entry in outbox_entries(username, 'share') if entry['id'] not in outbox_shares.values()]
+            if waiting and await run_blocking(server_reachable):
+                for entry in waiting:
+                    queue_share(entry)
+            await asyncio.sleep(OUTBOX_RETRY_INTERVAL)
+
+    def transfer_status(transfer):
+        arrow = "⬆️" if transfer.kind == "upload" else "⬇️"
+        if transfer.status == "done":
+            code = f" Code: {transfer.file_code}" if transfer.file_code else ""
+            saved = f" Saved to {transfer.saved_to}" if transfer.saved_to else ""
+            return f"{GREEN}✓ {arrow} #{transfer.id} {transfer.name} done.{code}{saved}{RESET}"
+        if transfer.status == "cancelled":
+            return f"{YELLOW}✗ {arrow} #{transfer.id} {transfer.name} cancelled{RESET}"
+        error = f": {transfer.error}" if transfer.error else ""
+        return f"{RED}✗ {arrow} #{transfer.id} {transfer.name} failed{error}{RESET}"
+
+    if current_mode == "room":
+        await enter_room(current_room_id, current_room_name)
+    else:
+        await reload_view()
+
+    send_queue.notify = lambda item: post('sent', item)
+    restored = send_queue.restore(username)
+    if restored:
+        screen.status = f"{YELLOW}↻ Sending {restored} message(s) left in the outbox{RESET}"
+        redraw()
+
+    loop.add_reader(sys.stdin, read_input)
+    spawn(replay_shares())
+    spawn(watch_room_deleted(post))
+    spawn(keep_views_warm())
+    spawn(watch_other_views())
+
+    try:
+        while not exit_flag:
+            sync_receiver()
+            screen.show_prompt()
+            event = await events.get()
+            kind = event[0]
+
+            if kind == 'eof':
+                break
+
+            if kind == 'messages':
+                on_messages(*event[1:])
+                continue
+
+            if kind == 'scroll':
+                await scroll(event[1])
+                continue
+
+            if kind == 'unread':
+                redraw()
+                continue
+
+            if kind == 'sent':
+                await on_sent(event[1])
+                continue
+
+            if kind == 'transfer_done':
+                # Shared files show up as messages: pick them up
+                screen.status = transfer_status(active_transfers[event[1]])
+                if event[1] in outbox_shares:
+                    await share_done(active_transfers[event[1]])
+                await reload_view(delta=True)
+                continue
+
+            if kind == 'room_deleted':
+                if current_mode == "room" and current_room_id == event[1]:
+                    print(f"\n{RED}Room {current_room_id} has been deleted by admin!{RESET}")
+                    print(f"{GRAY}Returning to public chat...{RESET}")
+                    await asyncio.sleep(2)
+                    await back_to_public()
+                view_cache.drop(("room", event[1]))
+                prune_store()
+                unread_counts.pop(("room", event[1]), None)
+                continue
+
+            message = event[1]
+            poll_scheduler.wake()
+            if message == "":
+                continue
+
+            command = check_command(message)
+            if command != 'normal_message' or message.lower() == '!exit':
+                screen.newline()
+
+            if command == 'switch_to_public':
+                screen.status = f"{GREEN}✓ Switched to PUBLIC CHAT{RESET}"
+                await show_view("public")
+                continue
+
+            elif command == 'switch_to_private':
+                screen.status = f"{GREEN}✓ Switched to PRIVATE MESSAGES{RESET}"
+                await show_view("private")
+                continue
+
+            elif command == 'list_rooms':
+                has_rooms, room_selection = await modal(display_rooms_list, username)
+
+                if has_rooms and room_selection:
+                    room_id, room_name = room_selection
+
+                    if current_mode == "room" and current_room_id == room_id:
+                        print(f"{GRAY}You're already in this room{RESET}")
+                        await asyncio.sleep(1)
+                        redraw()
+                    elif view_cache.get(("room", room_id)):
+                        # Joined earlier this session: just switch back
+                        await enter_room(room_id, room_name)
                     else:
-                        print(f"{RED}✗ Failed to create room: {msg}{RESET}")
-                        time.sleep(2)
-                        if current_mode == "public":
-                            display_public_chat(username, messages, show_prompt=True)
-                        elif current_mode == "private":
-                            display_private_chat(username, private_messages, show_prompt=True)
+                        print(f"{GRAY}Joining {room_name}...{RESET}")
+                        success, join_data = await run_blocking(join_room, room_id, username)
+
+                        if success:
+                            print(f"{GREEN}✓ Joined room successfully!{RESET}")
+                            rooms_checked = 0
+                            await asyncio.sleep(1)
+                            await enter_room(room_id, room_name)
                         else:
-                            display_room_chat(username, room_messages, room_info, show_prompt=True)
+                            print(f"{RED}✗ Failed to join room: {join_data.get('message', 'Unknown error')}{RESET}")
+                            await asyncio.sleep(2)
+                            redraw()
+
+                elif not has_rooms:
+                    await reload_view()
+
+                continue
+
+            elif command == 'create_room':
+                print(f"\n{YELLOW}Enter room name: {RESET}", end='', flush=True)
+                room_name = ""
+                while not room_name.strip():
+                    room_name = await modal(prompt_line)
+
+                print(f"{GRAY}Creating room '{room_name}'...{RESET}")
+                success, room_id, msg = await run_blocking(create_room, room_name, username)
+
+                if success:
+                    print(f"{GREEN}✓ Room created! ID: {room_id}{RESET}")
+                    print(f"{GRAY}Share this ID with others: {room_id}{RESET}")
+
+                    await asyncio.sleep(2)
+
+                    join_success, join_data = await run_blocking(join_room, room_id, username)
+                    if join_success:
+                        rooms_checked = 0
+                        await enter_room(room_id, room_name, join_data.get('room'))
+                else:
+                    print(f"{RED}✗ Failed to create room: {msg}{RESET}")
+                    await asyncio.sleep(2)
+                    redraw()
+                continue
+
+            elif command == 'join_room':
+                parts = message.split(' ', 1)
+                if len(parts) < 2:
+                    print(f"\n{YELLOW}Enter room ID to join: {RESET}", end='', flush=True)
+                    room_id = (await modal(prompt_line)).strip().upper()
+                else:
+                    room_id = parts[1].strip().upper()
+
+                if not room_id:
+                    print(f"{RED}✗ Room ID cannot be empty{RESET}")
+                    await asyncio.sleep(1)
                     continue
-                
-                elif command == 'join_room':
-                    parts = message.split(' ', 1)
-                    if len(parts) < 2:
-                        print(f"\n{YELLOW}Enter room ID to join: {RESET}", end='', flush=True)
-                        room_id = input().strip().upper()
-                    else:
-                        room_id = parts[1].strip().upper()
-                    
-                    if not room_id:
-                        print(f"{RED}✗ Room ID cannot be empty{RESET}")
-                        time.sleep(1)
-                        continue
-                    
-                    print(f"{GRAY}Joining room {room_id}...{RESET}")
-                    success, join_data = join_room(room_id, username)
-                    
-                    if success:
-                        print(f"{GREEN}✓ Joined room successfully!{RESET}")
-                        
-                        success_info, info = get_room_info(room_id)
-                        room_name = info.get('name', f"Room {room_id}") if success_info else f"Room {room_id}"
-                        
-                        time.sleep(1)
-                        
-                        current_mode = "room"
-                        current_room_id = room_id
-                        current_room_name = room_name
-                        
-                        if success_info:
-                            room_info = info
-                            current_room_name = info.get('name', room_name)
-                        else:
-                            current_room_name = room_name
-                        
-                        room_messages = get_room_messages(room_id)
-                        display_room_chat(username, room_messages, room_info, show_prompt=True)
-                        last_room_message_count = len(room_messages)
-                        last_display_time = time.time()
-                    else:
-                        print(f"{RED}✗ Failed to join room: {join_data.get('message', 'Unknown error')}{RESET}")
-                        time.sleep(2)
-                        if current_mode == "public":
-                            display_public_chat(username, messages, show_prompt=True)
-                        elif current_mode == "private":
-                            display_private_chat(username, private_messages, show_prompt=True)
-                        else:
-                            display_room_chat(username, room_messages, room_info, show_prompt=True)
+
+                if view_cache.get(("room", room_id)) or (current_mode == "room" and current_room_id == room_id):
+                    await enter_room(room_id, f"Room {room_id}")
                     continue
-                
-                elif command == 'leave_room' and current_mode == "room":
-                    print(f"{GRAY}Leaving room {current_room_id}...{RESET}")
-                    success, msg = leave_room(current_room_id, username)
-                    
-                    if success:
-                        print(f"{GREEN}✓ Left room successfully{RESET}")
-                        
-                        time.sleep(1)
-                        
-                        current_mode = "public"
-                        current_room_id = "lobby"
-                        current_room_name = "Public Chat"
-                        
-                        messages = get_messages()
-                        display_public_chat(username, messages, show_prompt=True)
-                        last_message_count = len(messages)
-                        last_display_time = time.time()
-                    else:
-                        print(f"{RED}✗ Failed to leave room: {msg}{RESET}")
-                        time.sleep(2)
-                        display_room_chat(username, room_messages, room_info, show_prompt=True)
+
+                print(f"{GRAY}Joining room {room_id}...{RESET}")
+                success, join_data = await run_blocking(join_room, room_id, username)
+
+                if success:
+                    print(f"{GREEN}✓ Joined room successfully!{RESET}")
+                    rooms_checked = 0
+                    await asyncio.sleep(1)
+                    await enter_room(room_id, f"Room {room_id}")
+                else:
+                    print(f"{RED}✗ Failed to join room: {join_data.get('message', 'Unknown error')}{RESET}")
+                    await asyncio.sleep(2)
+                    redraw()
+                continue
+
+            elif command == 'leave_room' and current_mode == "room":
+                print(f"{GRAY}Leaving room {current_room_id}...{RESET}")
+                success, msg = await run_blocking(leave_room, current_room_id, username)
+
+                if success:
+                    print(f"{GREEN}✓ Left room successfully{RESET}")
+                    rooms_checked = 0
+                    await asyncio.sleep(1)
+                    left = ("room", current_room_id)
+                    await back_to_public()
+                    view_cache.drop(left)
+                    prune_store()
+                else:
+                    print(f"{RED}✗ Failed to leave room: {msg}{RESET}")
+                    await asyncio.sleep(2)
+                    redraw()
+                continue
+
+            # FILE SHARING COMMANDS
+            elif command == 'share_file':
+                if len(message.split(' ')) < 2:
+                    print(f"{RED}✗ Usage: /share filename [--expire 1h-24h]{RESET}")
+                    print(f"{GRAY}Example: /share document.pdf{RESET}")
+                    print(f"{GRAY}Example: /share photo.jpg --expire 2h{RESET}")
+                    await asyncio.sleep(2)
                     continue
-                
-                # FILE SHARING COMMANDS
-                elif command == 'share_file':
-                    # Parse: /share filename or /share filename --expire 2h
-                    parts = message.split(' ')
-                    
-                    if len(parts) < 2:
-                        print(f"{RED}✗ Usage: /share filename [--expire 1h-24h]{RESET}")
-                        print(f"{GRAY}Example: /share document.pdf{RESET}")
-                        print(f"{GRAY}Example: /share photo.jpg --expire 2h{RESET}")
-                        time.sleep(2)
-                        continue
-                    
-                    # Check for --expire option
-                    expire = "24h"
-                    filename = ""
-                    
-                    i = 1
-                    while i < len(parts):
-                        if parts[i] == '--expire' and i + 1 < len(parts):
-                            expire = parts[i + 1]
-                            i += 2
-                        else:
-                            if filename:
-                                filename += " " + parts[i]
-                            else:
-                                filename = parts[i]
-                            i += 1
-                    
-                    if not filename:
-                        print(f"{RED}✗ No filename specified{RESET}")
-                        time.sleep(2)
-                        continue
-                    
-                    # Handle @user for private file share
-                    private_to = None
-                    if current_mode == "private" or (filename.startswith('@') and ' ' in filename):
-                        # Format: @username filename
-                        if filename.startswith('@') and ' ' in filename:
-                            parts2 = filename.split(' ', 1)
-                            private_to = parts2[0][1:]  # Remove @
-                            filename = parts2[1]
-                    
-                    # Check if in room
-                    room_id = current_room_id if current_mode == "room" else None
-                    
-                    upload_file(username, filename, expire, room_id, private_to)
-                    
-                    # Refresh display
-                    if current_mode == "public":
-                        messages = get_messages()
-                        display_public_chat(username, messages, show_prompt=True)
-                    elif current_mode == "private":
-                        private_messages = get_private_messages(username)
-                        display_private_chat(username, private_messages, show_prompt=True)
-                    else:
-                        room_messages = get_room_messages(current_room_id)
-                        display_room_chat(username, room_messages, room_info, show_prompt=True)
-                    
+
+                filename, expire, private_to = read_file_share_args(message)
+
+                if not filename:
+                    print(f"{RED}✗ No filename specified{RESET}")
+                    await asyncio.sleep(2)
                     continue
-                
-                elif command == 'get_file':
-                    # Parse: /get CODE
-                    parts = message.split(' ')
-                    
-                    if len(parts) < 2:
-                        print(f"{RED}✗ Usage: /get FILECODE{RESET}")
-                        print(f"{GRAY}Example: /get ABC123{RESET}")
-                        time.sleep(2)
-                        continue
-                    
-                    file_code = parts[1].strip().upper()
-                    
-                    download_file(file_code, username)
-                    
-                    time.sleep(2)
-                    
-                    # Refresh display
-                    if current_mode == "public":
-                        messages = get_messages()
-                        display_public_chat(username, messages, show_prompt=True)
-                    elif current_mode == "private":
-                        private_messages = get_private_messages(username)
-                        display_private_chat(username, private_messages, show_prompt=True)
-                    else:
-                        room_messages = get_room_messages(current_room_id)
-                        display_room_chat(username, room_messages, room_info, show_prompt=True)
-                    
+
+                # Check if in room
+                room_id = current_room_id if current_mode == "room" else None
+
+                entry = {'id': f"{username}-share-{time.time_ns()}", 'kind': 'share', 'sender': username,
+                         'filepath': os.path.abspath(filename), 'expire': expire, 'room_id': room_id, 'private_to': private_to}
+                outbox_add(entry)
+                queue_share(entry)
+                continue
+
+            elif command == 'get_file':
+                # Parse: /get CODE
+                parts = message.split(' ')
+
+                if len(parts) < 2:
+                    print(f"{RED}✗ Usage: /get FILECODE{RESET}")
+                    print(f"{GRAY}Example: /get ABC123{RESET}")
+                    await asyncio.sleep(2)
                     continue
-                
-                elif command == 'list_files':
+
+                file_code = parts[1].strip().upper()
+
+                queue_transfer("download", file_code, download_file, file_code, username)
+                continue
+
+            elif command == 'list_files':
+                def show_files():
                     list_files(username)
-                    
                     print(f"\n{YELLOW}Press Enter to continue...{RESET}", end='', flush=True)
                     input()
-                    
-                    # Refresh display
-                    if current_mode == "public":
-                        messages = get_messages()
-                        display_public_chat(username, messages, show_prompt=True)
-                    elif current_mode == "private":
-                        private_messages = get_private_messages(username)
-                        display_private_chat(username, private_messages, show_prompt=True)
-                    else:
-                        room_messages = get_room_messages(current_room_id)
-                        display_room_chat(username, room_messages, room_info, show_prompt=True)
-                    
-                    continue
-                
-                elif command == 'unshare_file':
-                    # Parse: /unshare CODE
-                    parts = message.split(' ')
-                    
-                    if len(parts) < 2:
-                        print(f"{RED}✗ Usage: /unshare FILECODE{RESET}")
-                        print(f"{GRAY}Example: /unshare ABC123{RESET}")
-                        time.sleep(2)
-                        continue
-                    
-                    file_code = parts[1].strip().upper()
-                    
-                    unshare_file(file_code, username)
-                    
-                    time.sleep(2)
-                    
-                    # Refresh display
-                    if current_mode == "public":
-                        messages = get_messages()
-                        display_public_chat(username, messages, show_prompt=True)
-                    elif current_mode == "private":
-                        private_messages = get_private_messages(username)
-                        display_private_chat(username, private_messages, show_prompt=True)
-                    else:
-                        room_messages = get_room_messages(current_room_id)
-                        display_room_chat(username, room_messages, room_info, show_prompt=True)
-                    
-                    continue
-                
-                # ADDED: Help command handler
-                elif command == 'show_help':
-                    show_help()
-                    
-                    # Refresh display after help
-                    if current_mode == "public":
-                        messages = get_messages()
-                        display_public_chat(username, messages, show_prompt=True)
-                        last_message_count = len(messages)
-                    elif current_mode == "private":
-                        private_messages = get_private_messages(username)
-                        display_private_chat(username, private_messages, show_prompt=True)
-                        last_pm_count = len(private_messages)
-                    else:
-                        room_messages = get_room_messages(current_room_id)
-                        display_room_chat(username, room_messages, room_info, show_prompt=True)
-                        last_room_message_count = len(room_messages)
-                    
-                    last_display_time = time.time()
+
+                await modal(show_files)
+                await reload_view(delta=True)
+                continue
+
+            elif command == 'unshare_file':
+                # Parse: /unshare CODE
+                parts = message.split(' ')
+
+                if len(parts) < 2:
+                    print(f"{RED}✗ Usage: /unshare FILECODE{RESET}")
+                    print(f"{GRAY}Example: /unshare ABC123{RESET}")
+                    await asyncio.sleep(2)
                     continue
-                
-                if message.lower() == '!exit':
-                    print(f"{YELLOW}Goodbye!{RESET}")
-                    break
-                
-                if message.strip():
-                    success, msg_type = send_message(username, message, current_room_id)
-                    if success:
-                        sys.stdout.write("\033[F\033[K")
-                        
-                        if message.startswith('@'):
-                            print(f"{GREEN}✓ Private message sent{RESET}")
-                        elif current_mode == "room":
-                            print(f"{GREEN}✓ Room message sent{RESET}")
-                        else:
-                            print(f"{GREEN}✓ Message sent{RESET}")
-                        
-                        time.sleep(0.1)
-                        
-                        # Clear success message
-                        sys.stdout.write("\033[F\033[K")
-                        
-                        if current_mode == "public":
-                            messages = get_messages()
-                            display_public_chat(username, messages, show_prompt=True)
-                            last_message_count = len(messages)
-                        elif current_mode == "private":
-                            private_messages = get_private_messages(username)
-                            display_private_chat(username, private_messages, show_prompt=True)
-                            last_pm_count = len(private_messages)
-                        else:
-                            room_messages = get_room_messages(current_room_id)
-                            display_room_chat(username, room_messages, room_info, show_prompt=True)
-                            last_room_message_count = len(room_messages)
-                        
-                        last_display_time = time.time()
-                    else:
-                        if msg_type == 'room_deleted':
-                            print(f"{RED}✗ Room has been deleted by admin{RESET}")
-                            time.sleep(2)
-                            current_mode = "public"
-                            current_room_id = "lobby"
-                            current_room_name = "Public Chat"
-                            messages = get_messages()
-                            display_public_chat(username, messages, show_prompt=True)
-                            last_message_count = len(messages)
-                            last_display_time = time.time()
-                        else:
-                            print(f"{RED}✗ Failed to send message{RESET}")
-            
-            time.sleep(0.05)
-            
-    except KeyboardInterrupt:
-        print(f"\n{YELLOW}Exiting... Goodbye!{RESET}")
-    except Exception as e:
-        print(f"\n{RED}Error: {e}{RESET}")
+
+                file_code = parts[1].strip().upper()
+
+                await run_blocking(unshare_file, file_code, username)
+                await asyncio.sleep(2)
+                await reload_view(delta=True)
+                continue
+
+            elif command == 'scroll':
+                parts = message.lower().split()
+                await scroll(parts[1] if len(parts) > 1 else "up")
+                continue
+
+            elif command == 'show_transfers':
+                await modal(show_transfers)
+                redraw()
+                continue
+
+            elif command == 'control_transfer':
+                screen.status = control_transfer(message)
+                redraw()
+                continue
+
+            elif command == 'show_help':
+                await modal(show_help)
+                await reload_view(delta=True)
+                continue
+
+            if message.lower() == '!exit':
+                print(f"{YELLOW}Goodbye!{RESET}")
+                break
+
+            if message.strip():
+                if message.startswith('@'):
+                    target = ("private", username)
+                else:
+                    target = current_view(username)
+                    if target[0] == "private":
+                        target = ("public", None)
+                send_queue.submit(username, message, current_room_id, target)
+                if target == current_view(username):
+                    redraw()
     finally:
-        print(RESET)
+        loop.remove_reader(sys.stdin)
+        if send_queue.unsent():
+            print(f"{GRAY}Sending queued messages...{RESET}")
+            if not send_queue.wait_sent(5):
+                print(f"{YELLOW}⏸ {send_queue.unsent()} message(s) kept in the outbox, they'll be sent next time{RESET}")
+        if receiver:
+            receiver.stop()
+        for task in background_tasks:
+            task.cancel()
 
 def main():
     global exit_flag